@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the local (non-API) stages of the conversion pipeline
+
+Generates synthetic HTML pages, Bricks trees and model responses from 10 KB up to
+100 MB, measures time and peak memory of each local stage, saves the results as JSON
+and compares them against a stored baseline.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from conversion import (
+    ReasoningFilter, build_messages, clean_output, filter_reasoning,
+    write_request_log, write_response_log
+)
+
+SIZES = {
+    "10KB": 10 * 1024,
+    "100KB": 100 * 1024,
+    "1MB": 1024 * 1024,
+    "10MB": 10 * 1024 * 1024,
+    "100MB": 100 * 1024 * 1024
+}
+DEFAULT_SIZES = ["10KB", "100KB", "1MB", "10MB"]
+DEFAULT_OUTPUT = "benchmark_results.json"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+STREAM_CHUNK_SIZE = 16
+# Differences below these are timer/allocator noise, not regressions
+NOISE_FLOOR = {"seconds": 0.001, "peak_bytes": 64 * 1024}
+
+WORDS = ["bricks", "builder", "section", "hero", "card", "pricing", "feature", "team", "contact", "welcome"]
+TAGS = ["section", "div", "h2", "p", "a", "button", "ul", "li", "span"]
+SETTING_KEYS = ["_padding", "_margin", "_background", "_color", "_fontSize", "_borderRadius", "_display", "_width"]
+
+def generate_html(size: int, seed: int = 0) -> str:
+    """Generate a synthetic HTML page of roughly `size` characters"""
+    rng = random.Random(seed)
+    parts = ["<!DOCTYPE html><html><head><title>Synthetic</title></head><body>\n"]
+    length = len(parts[0])
+    index = 0
+    while length < size:
+        tag = rng.choice(TAGS)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        block = (
+            f'<div class="block-{index}" style="padding: {rng.randint(0, 60)}px; color: #{rng.randint(0, 0xffffff):06x};">\n'
+            f'  <{tag} class="item">{text}</{tag}>\n'
+            f'</div>\n'
+        )
+        parts.append(block)
+        length += len(block)
+        index += 1
+    parts.append("</body></html>\n")
+    return "".join(parts)
+
+def generate_bricks_tree(size: int, seed: int = 0, indent: Optional[int] = None) -> dict:
+    """Generate a nested Bricks element tree whose JSON (dumped with `indent`) is roughly `size` characters"""
+    rng = random.Random(seed)
+    elements = []
+    length = 0
+    index = 0
+    while length < size:
+        children = []
+        for child_index in range(rng.randint(1, 4)):
+            child = {
+                "id": f"el{index}c{child_index}",
+                "name": rng.choice(["heading", "text", "button", "image"]),
+                "component": "text",
+                "settings": {key: f"{rng.randint(0, 60)}px" for key in rng.sample(SETTING_KEYS, 3)},
+                "elements": []
+            }
+            child["settings"]["text"] = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+            children.append(child)
+        element = {
+            "id": f"el{index}",
+            "name": "div",
+            "component": "div",
+            "settings": {key: f"{rng.randint(0, 60)}px" for key in rng.sample(SETTING_KEYS, 4)},
+            "elements": children
+        }
+        elements.append(element)
+        if indent:
+            # Every line of an element sits two levels deep in {"elements": [...]}
+            element_json = json.dumps(element, indent=indent)
+            length += len(element_json) + 2 * indent * (element_json.count("\n") + 1) + 2
+        else:
+            length += len(json.dumps(element)) + 2
+        index += 1
+    return {"elements": elements}
+
+def generate_response(size: int, seed: int = 0) -> str:
+    """Generate a model response of roughly `size` characters: a reasoning block followed by fenced Bricks JSON"""
+    tree_json = json.dumps(generate_bricks_tree(size * 9 // 10, seed, indent=2), indent=2)
+    answer = f"</think>\n```json\n{tree_json}\n```"
+    reasoning_size = max(24, size - len("<think>") - len(answer))
+    reasoning = ("Let me plan the layout. " * (reasoning_size // 24 + 1))[:reasoning_size]
+    return f"<think>{reasoning}{answer}"
+
+def build_stages(size: int, workdir: str) -> Dict[str, Callable[[], object]]:
+    """Create the benchmark stages for one input size, with inputs generated up front
+
+    A stage is a callable, or a (setup, callable) pair whose setup runs untimed before each run.
+    """
+    html = generate_html(size)
+    response = generate_response(size)
+    tree_json = json.dumps(generate_bricks_tree(size))
+    template = json.dumps(generate_bricks_tree(2048), indent=2)
+    chunks = [response[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(response), STREAM_CHUNK_SIZE)]
+    request_log = os.path.join(workdir, "request.json")
+    response_log = os.path.join(workdir, "response.json")
+    request_only_log = os.path.join(workdir, "request_only.json")
+    write_request_log(request_only_log, html, template, "benchmark", 0.6, 0.95, 8000)
+
+    def reset_response_log():
+        # Start every run from a request-only log, like a real conversion
+        shutil.copyfile(request_only_log, response_log)
+
+    return {
+        "prompt_assembly": lambda: build_messages(html, template),
+        "clean_output": lambda: clean_output(response),
+        "reasoning_filter": lambda: "".join(filter_reasoning(chunks, ReasoningFilter())),
+        "log_request": lambda: write_request_log(request_log, html, template, "benchmark", 0.6, 0.95, 8000),
+        "log_response": (reset_response_log, lambda: write_response_log(response_log, response, response, True)),
+        "json_load": lambda: json.loads(tree_json)
+    }
+
+def measure(stage: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> dict:
+    """Best wall time over `repeat` runs, then peak traced memory of one more run
+
+    `setup` runs before each run and is neither timed nor traced.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": round(min(times), 6), "peak_bytes": peak}
+
+def run_benchmarks(sizes: List[str], stages: Optional[List[str]] = None, repeat: int = 3) -> dict:
+    """Run every stage for every size and return the results"""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size_name in sizes:
+            size_stages = build_stages(SIZES[size_name], workdir)
+            for stage_name, stage in size_stages.items():
+                if stages and stage_name not in stages:
+                    continue
+                setup, stage = stage if isinstance(stage, tuple) else (None, stage)
+                result = measure(stage, repeat, setup)
+                results[f"{stage_name}/{size_name}"] = result
+                print(f"  {stage_name:<18} {size_name:>6}  {result['seconds'] * 1000:10.2f} ms  {result['peak_bytes'] / 1024 / 1024:10.2f} MB peak")
+    return {
+        "python": sys.version.split()[0],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = 0.25) -> List[str]:
+    """Return a description of every result that regressed by more than `threshold`"""
+    regressions = []
+    for key, result in current["results"].items():
+        previous = baseline["results"].get(key)
+        if not previous:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if result[metric] - previous[metric] < NOISE_FLOOR[metric]:
+                continue
+            if previous[metric] and result[metric] > previous[metric] * (1 + threshold):
+                change = (result[metric] / previous[metric] - 1) * 100
+                regressions.append(f"{key} {metric}: {previous[metric]} -> {result[metric]} (+{change:.0f}%)")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the local stages of the conversion pipeline")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=DEFAULT_SIZES, help="Input sizes to benchmark")
+    parser.add_argument("--stages", nargs="+", help="Only run these stages")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (best is kept)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="File to save results to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown before a result counts as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    print("⏱️ Benchmarking local pipeline stages")
+    current = run_benchmarks(args.sizes, args.stages, args.repeat)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, indent=2)
+    print(f"📁 Results saved to: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"📌 Baseline saved to: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("ℹ️ No baseline found - run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} regressions against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"✅ No regressions against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
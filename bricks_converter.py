@@ -7,6 +7,12 @@ from typing import Generator
 from streamlit_ace import st_ace
 from datetime import datetime
 import traceback
+from conversion import create_conversion_stream, iter_stream_content, ReasoningFilter, write_request_log, write_response_log, tokens_saved, estimate_tokens
+from job_queue import JobQueue, ConversionScheduler, estimate_request_tokens, STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED
+from ingest import ingest_file, ingest_path
+from global_classes import hoist_global_classes
+from output_viewer import OutputDocument, LARGE_OUTPUT_THRESHOLD, CHILDREN_PAGE_SIZE, STREAM_TAIL_SIZE, stream_tail
+import time
 
 # Page configuration
 st.set_page_config(
@@ -79,75 +85,93 @@ def log_conversion_request(input_content: str, json_template: str, model: str, t
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # microseconds to milliseconds
     log_file = os.path.join(history_dir, f"request_{timestamp}.json")
     
-    log_data = {
-        "timestamp": datetime.now().isoformat(),
-        "type": "request",
-        "model": model,
-        "parameters": {
-            "temperature": temperature,
-            "top_p": top_p,
-            "max_tokens": max_tokens
-        },
-        "input_content": input_content,
-        "json_template": json_template
-    }
-    
     try:
-        with open(log_file, 'w', encoding='utf-8') as f:
-            json.dump(log_data, f, indent=2, ensure_ascii=False)
+        write_request_log(log_file, input_content, json_template, model, temperature, top_p, max_tokens)
     except Exception as e:
         st.error(f"Failed to log request: {str(e)}")
     
     return log_file
 
-def log_conversion_response(log_file: str, raw_response: str, cleaned_response: str, success: bool = True, error: str = None):
+def log_conversion_response(log_file: str, raw_response: str, cleaned_response: str, success: bool = True, error: str = None, metrics: dict = None):
     """Log conversion response to the same file as request"""
     try:
-        # Read existing log data
-        with open(log_file, 'r', encoding='utf-8') as f:
-            log_data = json.load(f)
-        
-        # Add response data
-        log_data["response"] = {
-            "timestamp": datetime.now().isoformat(),
-            "success": success,
-            "raw_response": raw_response,
-            "cleaned_response": cleaned_response,
-            "error": error
-        }
-        
-        # Write back to file
-        with open(log_file, 'w', encoding='utf-8') as f:
-            json.dump(log_data, f, indent=2, ensure_ascii=False)
-            
+        write_response_log(log_file, raw_response, cleaned_response, success, error, metrics)
     except Exception as e:
         st.error(f"Failed to log response: {str(e)}")
 
-def clean_output(text: str) -> str:
-    """Clean the output by removing markdown code blocks and thinking tags"""
-    import re
-    
-    # Remove thinking tags and their content
-    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
-    text = re.sub(r'<thinking>.*?</thinking>', '', text, flags=re.DOTALL)
-    
-    # Remove markdown code block markers
-    text = text.strip()
+def set_output_document(doc: OutputDocument):
+    """Show a new large output, dropping the tree and raw page view state of the previous one"""
+    st.session_state.output_document = doc
+    st.session_state.expanded_paths = set()
+    st.session_state.pop("raw_stream_page", None)
+    for key in [key for key in st.session_state if str(key).startswith("tree_shown_")]:
+        del st.session_state[key]
+
+def store_conversion_output(raw_response: str, cleaned_response: str):
+    """Store a conversion result in session state, keeping a single copy of large outputs"""
+    if len(raw_response) > LARGE_OUTPUT_THRESHOLD:
+        set_output_document(OutputDocument(raw_response, cleaned_response))
+        st.session_state.streaming_output = ""
+        st.session_state.converted_output = ""
+    else:
+        st.session_state.output_document = None
+        st.session_state.streaming_output = raw_response  # Raw stream
+        st.session_state.converted_output = cleaned_response  # Cleaned JSON
+
+def record_cancelled_conversion(log_file: str, chunks: list, output_chunks: list, reasoning_filter: ReasoningFilter, max_tokens: int):
+    """Keep the partial output of an interrupted conversion and log it with the tokens saved"""
+    tail = reasoning_filter.flush()
+    if tail:
+        output_chunks.append(tail)
+    metrics = reasoning_filter.metrics()
+    metrics["cancelled"] = True
+    metrics["tokens_saved"] = tokens_saved(max_tokens, metrics)
+    full_response = "".join(chunks)
+    cleaned_response = "".join(output_chunks)
     
-    # Remove ```json at the start
-    if text.startswith('```json'):
-        text = text[7:]
-    elif text.startswith('```'):
-        text = text[3:]
+    log_conversion_response(log_file, full_response, cleaned_response, False, "Cancelled by user", metrics)
+    store_conversion_output(full_response, cleaned_response)
+    st.session_state.conversion_metrics = metrics
+
+def render_json_tree(doc: OutputDocument, path: tuple = (), depth: int = 0):
+    """Render the children of an expanded node; collapsed subtrees are never sent to the browser"""
+    expanded = st.session_state.setdefault("expanded_paths", set())
+    shown_key = f"tree_shown_{path}"
+    shown = st.session_state.get(shown_key, CHILDREN_PAGE_SIZE)
     
-    # Remove ``` at the end
-    if text.endswith('```'):
-        text = text[:-3]
+    indent = "\u2003" * depth
     
-    # Clean up extra whitespace but preserve JSON formatting
-    text = text.strip()
+    for child_path, label, expandable in doc.children(path, 0, shown):
+        if expandable:
+            is_open = child_path in expanded
+            if st.button(f"{indent}{'▾' if is_open else '▸'} {label}", key=f"tree_{child_path}"):
+                if is_open:
+                    expanded.discard(child_path)
+                else:
+                    expanded.add(child_path)
+                st.rerun()
+            if is_open:
+                render_json_tree(doc, child_path, depth + 1)
+        else:
+            st.text(f"{indent}  {label}")
     
-    return text
+    remaining = doc.child_count(path) - shown
+    if remaining > 0:
+        if st.button(f"{indent}… show {min(remaining, CHILDREN_PAGE_SIZE)} more of {remaining}", key=f"tree_more_{path}"):
+            st.session_state[shown_key] = shown + CHILDREN_PAGE_SIZE
+            st.rerun()
+
+def render_raw_pages(doc: OutputDocument):
+    """Render one page of the raw response at a time"""
+    page_count = doc.page_count()
+    page = st.number_input(
+        f"Page (of {page_count})",
+        min_value=1,
+        max_value=page_count,
+        value=1,
+        key="raw_stream_page"
+    )
+    st.code(doc.raw_page(page - 1), language=None)
 
 def get_api_key() -> str:
     """Get API key from session state or environment variable"""
@@ -166,52 +190,67 @@ def initialize_cerebras_client():
         st.error(f"Failed to initialize Cerebras client: {str(e)}")
         return None
 
-def stream_conversion(client: Cerebras, input_content: str, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000, temperature: float = 0.6, top_p: float = 0.95) -> Generator[str, None, None]:
-    """Stream the conversion process using Cerebras API"""
-    
-    user_prompt = f"""Please convert the following input content to Bricks Builder JSON format using the provided template as a reference.
-
-INPUT CONTENT:
-{input_content}
-
-JSON TEMPLATE (use this structure as a guide):
-{json_template}
+@st.cache_resource
+def get_job_scheduler() -> ConversionScheduler:
+    """Start (once per process) the background worker pool for queued conversions"""
+    return ConversionScheduler(
+        JobQueue(),
+        client_factory=lambda api_key: Cerebras(api_key=api_key)
+    ).start()
 
-INSTRUCTIONS:
-1. Maintain the Bricks Builder JSON structure shown in the template
-2. Convert HTML elements to appropriate Bricks Builder components
-3. Preserve styling and layout as much as possible
-4. Ensure the output is valid JSON
-5. Return ONLY the JSON, no additional text or explanations
-6. Do not wrap the JSON in markdown code blocks (no ```json or ```)
-
-CONVERTED JSON:"""
+def wait_with_status(seconds: float, status, message: str):
+    """Sleep in short steps, updating `status` each step so a rerun (e.g. Stop) can interrupt the wait"""
+    deadline = time.monotonic() + seconds
+    remaining = seconds
+    while remaining > 0:
+        if status is not None:
+            status.info(message.format(remaining=remaining))
+        time.sleep(min(0.5, remaining))
+        remaining = deadline - time.monotonic()
 
+def stream_conversion(client: Cerebras, input_content: str, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000, temperature: float = 0.6, top_p: float = 0.95,
+                      scheduler: ConversionScheduler = None, status=None) -> Generator[str, None, None]:
+    """Stream the conversion process using Cerebras API
+    
+    With a scheduler, the request is charged to the shared rate limits ahead of queued jobs,
+    and rate limits and server errors are retried with the same backoff as queued jobs.
+    Errors are raised, never yielded as output.
+    """
+    estimated_tokens = estimate_request_tokens(input_content, json_template, max_tokens)
+    attempt = 0
+    while True:
+        attempt += 1
+        if scheduler is not None:
+            wait = scheduler.reserve_interactive(model, estimated_tokens)
+            try:
+                wait_with_status(wait, status, "⏳ Waiting for rate limit... {remaining:.0f}s")
+            except BaseException:
+                # Interrupted before sending: the reservation was never used
+                scheduler.limiter.release(model, estimated_tokens)
+                raise
+        try:
+            stream = create_conversion_stream(client, input_content, json_template, model, max_tokens, temperature, top_p)
+            break
+        except Exception as e:
+            delay = scheduler.handle_error(model, e, attempt) if scheduler is not None else None
+            if delay is None:
+                raise
+            # Rejected before generating anything: only the prompt estimate stays charged
+            scheduler.limiter.settle(model, estimated_tokens, estimated_tokens - max_tokens)
+            wait_with_status(delay, status, f"⏳ {type(e).__name__}, retrying in {{remaining:.0f}}s...")
+    
+    generated = []
     try:
-        stream = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert in Bricks Builder and perfect JSON."
-                },
-                {
-                    "role": "user",
-                    "content": user_prompt
-                }
-            ],
-            model=model,
-            stream=True,
-            max_completion_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p
-        )
-        
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
-                
-    except Exception as e:
-        yield f"Error during conversion: {str(e)}"
+        for content in iter_stream_content(stream):
+            generated.append(content)
+            yield content
+    finally:
+        # Release the HTTP connection if the consumer stops early
+        if hasattr(stream, "close"):
+            stream.close()
+        if scheduler is not None:
+            # Charge only what was generated, also when stopped early (Stop button, reasoning cap)
+            scheduler.limiter.settle(model, estimated_tokens, estimated_tokens - max_tokens + estimate_tokens("".join(generated)))
 
 def main():
     st.title("🧱 HTML to Bricks Builder JSON Converter")
@@ -292,6 +331,26 @@ def main():
             step=500,
             help="Maximum tokens in the response"
         )
+        
+        # Reasoning budget for thinking models
+        max_reasoning_tokens = st.number_input(
+            "Max Reasoning Tokens",
+            min_value=0,
+            max_value=40000,
+            value=0,
+            step=500,
+            help="Stop the conversion if the model's <think> block exceeds this many tokens (0 = no limit)"
+        )
+        
+        # Global class hoisting threshold
+        global_class_threshold = st.number_input(
+            "Global Class Threshold",
+            min_value=2,
+            max_value=100,
+            value=3,
+            step=1,
+            help="Minimum number of elements with identical styles before they are moved into a global class"
+        )
     
     # Main layout - three columns for input/template/output, plus streaming section below
     col1, col2, col3 = st.columns(3)
@@ -305,25 +364,73 @@ def main():
         with col_clear1:
             if st.button("🗑️ Clear", key="clear_input"):
                 st.session_state.input_content = ""
+                if st.session_state.get("ingested_document"):
+                    st.session_state.ingested_document.remove()
+                    st.session_state.ingested_document = None
         with col_copy1:
             if st.button("📋 Copy", key="copy_input"):
                 if 'input_content' in st.session_state:
                     copy_to_clipboard(st.session_state.input_content, "Input copied!")
         
-        # Input code editor
-        input_content = st_ace(
-            value=st.session_state.get("input_content", ""),
-            language='html',
-            theme='monokai',
-            key="input_content",
-            height=400,
-            auto_update=True,
-            font_size=14,
-            tab_size=2,
-            wrap=True,
-            annotations=None,
-            placeholder="Paste your HTML, CSS, or any content here..."
-        )
+        ingested = st.session_state.get("ingested_document")
+        
+        # Large files are streamed to disk instead of being pasted into the editor
+        with st.expander("📂 Load large file"):
+            # The uploader keeps its file in server memory; a new key after loading releases it
+            upload_key = f"input_upload_{st.session_state.get('input_upload_generation', 0)}"
+            uploaded_file = st.file_uploader("Upload HTML file", type=["html", "htm"], key=upload_key)
+            local_path = st.text_input("...or local file path", key="input_local_path")
+            if st.button("📥 Load File", key="load_input_file", disabled=not (uploaded_file or local_path)):
+                try:
+                    if ingested:
+                        ingested.remove()
+                    if uploaded_file:
+                        ingested = ingest_file(uploaded_file, uploaded_file.name)
+                    else:
+                        ingested = ingest_path(local_path)
+                    st.session_state.ingested_document = ingested
+                    st.session_state.ingested_section = None
+                    if uploaded_file:
+                        st.session_state.input_upload_generation = st.session_state.get("input_upload_generation", 0) + 1
+                        st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to load file: {str(e)}")
+        
+        if ingested:
+            # Only a preview is sent to the browser; the full input is read from disk on conversion
+            st.caption(
+                f"📄 {ingested.name}: {ingested.source_size / 1024 / 1024:.1f} MB read, "
+                f"{ingested.size / 1024 / 1024:.1f} MB after preprocessing, {len(ingested.sections)} sections"
+            )
+            ingested_section = st.selectbox(
+                "Section to convert",
+                [None] + list(range(len(ingested.sections))),
+                format_func=lambda i: "Whole document" if i is None else ingested.section_label(i),
+                key="ingested_section"
+            )
+            st.code(ingested.preview(section=ingested_section), language="html")
+            if st.button("✖️ Close File", key="close_input_file"):
+                ingested.remove()
+                st.session_state.ingested_document = None
+                st.rerun()
+            input_content = ""
+        else:
+            # Input code editor
+            input_content = st_ace(
+                value=st.session_state.get("input_content", ""),
+                language='html',
+                theme='monokai',
+                key="input_content",
+                height=400,
+                auto_update=True,
+                font_size=14,
+                tab_size=2,
+                wrap=True,
+                annotations=None,
+                placeholder="Paste your HTML, CSS, or any content here..."
+            )
+        
+        has_input = bool(input_content) or ingested is not None
     
     # Middle column - JSON Template
     with col2:
@@ -382,33 +489,71 @@ def main():
         with col_clear3:
             if st.button("🗑️ Clear", key="clear_output"):
                 st.session_state.converted_output = ""
+                st.session_state.output_document = None
         with col_copy3:
             if st.button("📋 Copy", key="copy_output"):
-                if 'converted_output' in st.session_state:
+                if st.session_state.get("output_document"):
+                    copy_to_clipboard(st.session_state.output_document.cleaned, "Output copied!")
+                elif 'converted_output' in st.session_state:
                     copy_to_clipboard(st.session_state.converted_output, "Output copied!")
         
         # Initialize output in session state if not exists
         if 'converted_output' not in st.session_state:
             st.session_state.converted_output = ""
+        if 'output_document' not in st.session_state:
+            st.session_state.output_document = None
         
-        # Output code editor (editable) - use different key than session state
-        converted_output = st_ace(
-            value=st.session_state.get("converted_output", ""),
-            language='json',
-            theme='monokai',
-            key="output_ace_editor",  # Different key to avoid session state conflict
-            height=400,
-            auto_update=True,
-            font_size=14,
-            tab_size=2,
-            wrap=True,
-            annotations=None,
-            placeholder="Converted JSON will appear here..."
-        )
+        output_document = st.session_state.output_document
+        if output_document:
+            # Large output - browse the parsed tree instead of loading it into the editor
+            st.caption(f"Large output ({output_document.cleaned_size:,} characters) - expand elements to inspect them")
+            if output_document.tree is None:
+                st.warning(f"⚠️ Output is not valid JSON: {output_document.parse_error}")
+            else:
+                render_json_tree(output_document)
+        else:
+            # Output code editor (editable) - use different key than session state
+            converted_output = st_ace(
+                value=st.session_state.get("converted_output", ""),
+                language='json',
+                theme='monokai',
+                key="output_ace_editor",  # Different key to avoid session state conflict
+                height=400,
+                auto_update=True,
+                font_size=14,
+                tab_size=2,
+                wrap=True,
+                annotations=None,
+                placeholder="Converted JSON will appear here..."
+            )
+            
+            # Update session state if user manually edits the output
+            if converted_output != st.session_state.get("converted_output", ""):
+                st.session_state.converted_output = converted_output
         
-        # Update session state if user manually edits the output
-        if converted_output != st.session_state.get("converted_output", ""):
-            st.session_state.converted_output = converted_output
+        # Move repeated element styles into global classes
+        current_output = output_document.cleaned if output_document else st.session_state.converted_output
+        if st.button("🎨 Hoist Global Classes", key="hoist_classes", disabled=not current_output):
+            try:
+                hoisted, report = hoist_global_classes(json.loads(current_output), global_class_threshold)
+                hoisted_output = json.dumps(hoisted, indent=2, ensure_ascii=False)
+                if output_document:
+                    set_output_document(OutputDocument(output_document.raw, hoisted_output))
+                else:
+                    st.session_state.converted_output = hoisted_output
+                st.session_state.hoist_report = report
+                st.rerun()
+            except json.JSONDecodeError as e:
+                st.error(f"Output is not valid JSON: {str(e)}")
+            except ValueError as e:
+                st.error(f"Cannot hoist global classes: {str(e)}")
+        
+        report = st.session_state.get("hoist_report")
+        if report:
+            st.caption(
+                f"🎨 {report['classes_created']} global classes, {report['elements_updated']} elements updated · "
+                f"{report['bytes_before']:,} → {report['bytes_after']:,} bytes ({report['reduction_percent']}% smaller)"
+            )
     
     # Streaming Output Section (persistent after conversion)
     st.markdown("---")
@@ -423,26 +568,33 @@ def main():
     with col_clear_stream:
         if st.button("🗑️ Clear Stream", key="clear_stream"):
             st.session_state.streaming_output = ""
+            st.session_state.output_document = None
     with col_copy_stream:
         if st.button("📋 Copy Raw Stream", key="copy_stream"):
-            if st.session_state.streaming_output:
+            if st.session_state.output_document:
+                copy_to_clipboard(st.session_state.output_document.raw, "Raw stream copied!")
+            elif st.session_state.streaming_output:
                 copy_to_clipboard(st.session_state.streaming_output, "Raw stream copied!")
     
-    # Streaming output display (persistent ace editor)
-    streaming_display = st_ace(
-        value=st.session_state.get("streaming_output", ""),
-        language='text',
-        theme='monokai',
-        key="streaming_ace_editor",
-        height=200,
-        auto_update=True,
-        font_size=12,
-        tab_size=2,
-        wrap=True,
-        readonly=True,  # Read-only for viewing
-        annotations=None,
-        placeholder="Streaming output will appear here during conversion..."
-    )
+    if st.session_state.output_document:
+        # Large raw response - page through it instead of loading it all into the editor
+        render_raw_pages(st.session_state.output_document)
+    else:
+        # Streaming output display (persistent ace editor)
+        streaming_display = st_ace(
+            value=st.session_state.get("streaming_output", ""),
+            language='text',
+            theme='monokai',
+            key="streaming_ace_editor",
+            height=200,
+            auto_update=True,
+            font_size=12,
+            tab_size=2,
+            wrap=True,
+            readonly=True,  # Read-only for viewing
+            annotations=None,
+            placeholder="Streaming output will appear here during conversion..."
+        )
     
     # Conversion controls
     st.markdown("---")
@@ -452,23 +604,47 @@ def main():
         convert_button = st.button(
             "🚀 Convert to Bricks JSON",
             type="primary",
-            disabled=not (get_api_key() and input_content and json_template)
+            disabled=not (get_api_key() and has_input and json_template)
+        )
+        queue_button = st.button(
+            "📥 Queue as Batch Job",
+            disabled=not (get_api_key() and has_input and json_template),
+            help="Run the conversion in the background job queue (survives restarts)"
         )
     
     with col_status:
         if not get_api_key():
             st.error("❌ Please provide a Cerebras API key")
-        elif not input_content:
+        elif not has_input:
             st.warning("⚠️ Please enter content to convert")
         elif not json_template:
             st.warning("⚠️ Please provide a JSON template")
         else:
             st.success("✅ Ready to convert")
+        
+        metrics = st.session_state.get("conversion_metrics")
+        if metrics and metrics.get("cancelled"):
+            st.warning(f"⏹️ Conversion cancelled - partial output kept, ~{metrics['tokens_saved']} tokens saved")
+        if metrics and metrics.get("reasoning_limit_reached"):
+            st.warning(f"⚠️ Reasoning limit reached after ~{metrics['reasoning_tokens']} tokens - conversion stopped")
+        if metrics:
+            first_output = metrics["time_to_first_output"]
+            st.caption(
+                (f"⏱️ First output after {first_output}s · " if first_output is not None else "⏱️ No output · ") +
+                f"🧠 Reasoning: ~{metrics['reasoning_tokens']} tokens in {metrics['reasoning_seconds']}s · "
+                f"📦 Output: ~{metrics['output_tokens']} tokens · Total: {metrics['total_seconds']}s"
+            )
     
     # Handle conversion
-    if convert_button and get_api_key() and input_content and json_template:
+    if convert_button and get_api_key() and has_input and json_template:
         client = initialize_cerebras_client()
         if client:
+            if ingested:
+                input_content = ingested.read(st.session_state.ingested_section)
+            
+            # Interactive conversions count against the same rate limits as queued jobs, ahead of them
+            scheduler = get_job_scheduler()
+            
             # Log the request
             log_file = log_conversion_request(
                 input_content, json_template, model_choice, 
@@ -478,40 +654,74 @@ def main():
             # Clear previous outputs
             st.session_state.streaming_output = ""
             st.session_state.converted_output = ""
+            st.session_state.output_document = None
+            st.session_state.conversion_metrics = None
             
             # Show conversion progress
             st.info("🔄 Converting... (streaming response)")
             st.markdown("**🔄 Live Conversion Stream:**")
             
+            # Clicking stop reruns the script, which interrupts the streaming loop below
+            st.button("⏹️ Stop Conversion", key="stop_conversion")
+            
             # Create placeholder for live streaming
             live_stream_placeholder = st.empty()
             
             try:
-                # Initialize streaming variables
-                full_response = ""
+                # Collect chunks in lists; only the tail of the visible output is sent to the browser
+                chunks = []
+                output_chunks = []
+                last_render = 0.0
+                reasoning_filter = ReasoningFilter(max_reasoning_tokens or None)
+                conversion_stream = stream_conversion(
+                    client, input_content, json_template, model_choice, max_tokens, temperature, top_p,
+                    scheduler=scheduler, status=live_stream_placeholder
+                )
                 
-                # Create a generator that captures the stream
-                def conversion_generator():
-                    nonlocal full_response
-                    for chunk in stream_conversion(client, input_content, json_template, model_choice, max_tokens, temperature, top_p):
-                        full_response += chunk
-                        # Store in session state for persistent display
-                        st.session_state.streaming_output = full_response
-                        yield chunk
+                # Stream the conversion live, dropping reasoning blocks and code fences as they arrive
+                try:
+                    for chunk in conversion_stream:
+                        chunks.append(chunk)
+                        visible = reasoning_filter.feed(chunk)
+                        if visible:
+                            output_chunks.append(visible)
+                        if reasoning_filter.reasoning_limit_reached:
+                            conversion_stream.close()
+                            break
+                        now = time.monotonic()
+                        if now - last_render >= 0.2:
+                            if output_chunks:
+                                live_stream_placeholder.code(stream_tail(output_chunks, STREAM_TAIL_SIZE), language=None)
+                            elif reasoning_filter.in_reasoning:
+                                live_stream_placeholder.markdown(f"🧠 Reasoning... ~{reasoning_filter.reasoning_tokens} tokens")
+                            last_render = now
+                except BaseException as e:
+                    if not isinstance(e, Exception):
+                        # Script interrupted by a rerun (Stop button): close the upstream stream and keep the partial output
+                        conversion_stream.close()
+                        record_cancelled_conversion(log_file, chunks, output_chunks, reasoning_filter, max_tokens)
+                    raise
                 
-                # Stream the conversion live
-                with live_stream_placeholder.container():
-                    st.write_stream(conversion_generator())
+                tail = reasoning_filter.flush()
+                if tail:
+                    output_chunks.append(tail)
+                live_stream_placeholder.code(stream_tail(output_chunks, STREAM_TAIL_SIZE), language=None)
                 
-                # Clean the output
-                cleaned_response = clean_output(full_response)
+                full_response = "".join(chunks)
+                cleaned_response = "".join(output_chunks)
+                metrics = reasoning_filter.metrics()
+                error = None
+                if reasoning_filter.reasoning_limit_reached:
+                    metrics["reasoning_limit_reached"] = True
+                    error = f"Reasoning exceeded {max_reasoning_tokens} tokens - conversion stopped"
+                st.session_state.conversion_metrics = metrics
                 
                 # Log the response
-                log_conversion_response(log_file, full_response, cleaned_response, True)
+                log_conversion_response(log_file, full_response, cleaned_response, error is None, error, metrics)
                 
                 # Update both outputs in session state
-                st.session_state.streaming_output = full_response  # Raw stream
-                st.session_state.converted_output = cleaned_response  # Cleaned JSON
+                store_conversion_output(full_response, cleaned_response)
+                st.session_state.hoist_report = None
                 
                 # Show completion message
                 st.success("✅ Conversion completed! Check the output panels below.")
@@ -531,6 +741,47 @@ def main():
                 # Log the error
                 log_conversion_response(log_file, "", "", False, error_msg)
     
+    # Queue the conversion as a background batch job
+    if queue_button and get_api_key() and has_input and json_template:
+        if ingested:
+            input_content = ingested.read(st.session_state.ingested_section)
+        scheduler = get_job_scheduler()
+        job_id = scheduler.submit({
+            "input_content": input_content,
+            "json_template": json_template,
+            "model": model_choice,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p
+        }, api_key=get_api_key())
+        st.success(f"📥 Queued job `{job_id}`")
+    
+    # Background job queue
+    if get_api_key():
+        with st.expander("📦 Job Queue"):
+            scheduler = get_job_scheduler()
+            # Jobs submitted before a restart resume once their key is entered again
+            # The scheduler is shared by all sessions; show only the jobs submitted with this session's key
+            key_id = scheduler.register_api_key(get_api_key())
+            jobs = scheduler.queue.list_jobs(api_key_id=key_id)
+            if not jobs:
+                st.info("No queued jobs yet")
+            for job in jobs:
+                col_job, col_load, col_cancel = st.columns([4, 1, 1])
+                with col_job:
+                    st.markdown(f"`{job['id'][:8]}` · **{job['status']}** · attempts: {job['attempts']} · {job['created_at']}")
+                    if job["error"]:
+                        st.caption(job["error"])
+                with col_load:
+                    if job["status"] == STATUS_COMPLETED and st.button("📤 Load", key=f"load_{job['id']}"):
+                        result = scheduler.queue.result(job["id"])
+                        store_conversion_output(result["raw_response"], result["cleaned_response"])
+                        st.rerun()
+                with col_cancel:
+                    if job["status"] in (STATUS_QUEUED, STATUS_RUNNING) and st.button("✖️ Cancel", key=f"cancel_{job['id']}"):
+                        scheduler.cancel(job["id"])
+                        st.rerun()
+    
     # Footer with usage information
     st.markdown("---")
     with st.expander("ℹ️ How to use this tool"):
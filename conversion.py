@@ -0,0 +1,401 @@
+"""
+Core conversion helpers shared by the Streamlit app and headless tools
+"""
+
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Generator, List, Optional
+
+SYSTEM_PROMPT = "You are an expert in Bricks Builder and perfect JSON."
+
+def build_user_prompt(input_content: str, json_template: str) -> str:
+    """Build the user prompt for a conversion request"""
+    return f"""Please convert the following input content to Bricks Builder JSON format using the provided template as a reference.
+
+INPUT CONTENT:
+{input_content}
+
+JSON TEMPLATE (use this structure as a guide):
+{json_template}
+
+INSTRUCTIONS:
+1. Maintain the Bricks Builder JSON structure shown in the template
+2. Convert HTML elements to appropriate Bricks Builder components
+3. Preserve styling and layout as much as possible
+4. Ensure the output is valid JSON
+5. Return ONLY the JSON, no additional text or explanations
+6. Do not wrap the JSON in markdown code blocks (no ```json or ```)
+
+CONVERTED JSON:"""
+
+def build_messages(input_content: str, json_template: str) -> List[Dict[str, str]]:
+    """Build the chat messages for a conversion request"""
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": build_user_prompt(input_content, json_template)
+        }
+    ]
+
+def write_request_log(log_file: str, input_content: str, json_template: str, model: str, temperature: float, top_p: float, max_tokens: int):
+    """Write a conversion request to a history log file"""
+    log_data = {
+        "timestamp": datetime.now().isoformat(),
+        "type": "request",
+        "model": model,
+        "parameters": {
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens
+        },
+        "input_content": input_content,
+        "json_template": json_template
+    }
+
+    with open(log_file, 'w', encoding='utf-8') as f:
+        json.dump(log_data, f, indent=2, ensure_ascii=False)
+
+def write_response_log(log_file: str, raw_response: str, cleaned_response: str, success: bool = True, error: str = None, metrics: dict = None):
+    """Add a conversion response to an existing history log file"""
+    # Read existing log data
+    with open(log_file, 'r', encoding='utf-8') as f:
+        log_data = json.load(f)
+
+    # Add response data
+    log_data["response"] = {
+        "timestamp": datetime.now().isoformat(),
+        "success": success,
+        "raw_response": raw_response,
+        "cleaned_response": cleaned_response,
+        "error": error,
+        "metrics": metrics
+    }
+
+    # Write back to file
+    with open(log_file, 'w', encoding='utf-8') as f:
+        json.dump(log_data, f, indent=2, ensure_ascii=False)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used for rate limiting"""
+    return len(text) // 4 + 1
+
+def clean_output(text: str) -> str:
+    """Clean the output by removing markdown code blocks and thinking tags"""
+    # Remove thinking tags and their content
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<thinking>.*?</thinking>', '', text, flags=re.DOTALL)
+
+    # Remove markdown code block markers
+    text = text.strip()
+
+    # Remove ```json at the start
+    if text.startswith('```json'):
+        text = text[7:]
+    elif text.startswith('```'):
+        text = text[3:]
+
+    # Remove ``` at the end
+    if text.endswith('```'):
+        text = text[:-3]
+
+    # Clean up extra whitespace but preserve JSON formatting
+    text = text.strip()
+
+    return text
+
+REASONING_TAGS = {"<think>": "</think>", "<thinking>": "</thinking>"}
+FENCE_PATTERN = re.compile(r'```(?:json)?')
+MAX_HEAD_SIZE = 32
+MAX_TRAILING_HOLD = 64
+
+class ReasoningFilter:
+    """Constant-memory streaming counterpart of clean_output()
+
+    Feed raw stream chunks in; get back only the visible output. Reasoning blocks are
+    dropped as they arrive (tags may be split across chunks), a leading code fence is
+    removed once it is complete and a trailing fence is removed on flush(). Only a few
+    characters of lookahead are buffered at any time.
+
+    The output matches clean_output() except for a reasoning block that is never
+    closed: clean_output() keeps it, while the filter has already dropped it and
+    returns nothing after the opening tag.
+    """
+
+    def __init__(self, max_reasoning_tokens: Optional[int] = None):
+        self.max_reasoning_tokens = max_reasoning_tokens
+        self.reasoning_chars = 0
+        self.reasoning_seconds = 0.0
+        self.output_chars = 0
+        self.started_at = time.monotonic()
+        self.first_output_at = None
+        self._close_tag = None  # set while inside a reasoning block
+        self._reasoning_started_at = None
+        self._pending = ""  # possible partial tag
+        self._head = ""  # leading output until a code fence can be ruled out
+        self._started = False
+        self._fence_removed = False  # only one leading fence is removed, like clean_output()
+        self._trailing = ""  # trailing whitespace/backticks that may be a closing fence
+
+    @property
+    def in_reasoning(self) -> bool:
+        return self._close_tag is not None
+
+    @property
+    def reasoning_tokens(self) -> int:
+        return self.reasoning_chars // 4
+
+    @property
+    def reasoning_limit_reached(self) -> bool:
+        return bool(self.max_reasoning_tokens) and self.reasoning_tokens > self.max_reasoning_tokens
+
+    def metrics(self) -> dict:
+        """Timing and size metrics, with reasoning counted separately from output"""
+        reasoning_seconds = self.reasoning_seconds
+        if self._reasoning_started_at is not None:
+            reasoning_seconds += time.monotonic() - self._reasoning_started_at
+        return {
+            "reasoning_tokens": self.reasoning_tokens,
+            "reasoning_seconds": round(reasoning_seconds, 3),
+            "output_tokens": self.output_chars // 4,
+            "time_to_first_output": round(self.first_output_at - self.started_at, 3) if self.first_output_at else None,
+            "total_seconds": round(time.monotonic() - self.started_at, 3)
+        }
+
+    def feed(self, chunk: str) -> str:
+        """Consume a raw chunk and return the visible text it completes"""
+        text = self._pending + chunk
+        self._pending = ""
+        visible = []
+        position = 0
+
+        while position < len(text):
+            if self._close_tag is not None:
+                end = text.find(self._close_tag, position)
+                if end < 0:
+                    # Keep just enough to recognise a closing tag split across chunks
+                    keep = min(len(self._close_tag) - 1, len(text) - position)
+                    self.reasoning_chars += len(text) - position - keep
+                    self._pending = text[len(text) - keep:]
+                    break
+                self.reasoning_chars += end - position
+                position = end + len(self._close_tag)
+                self._close_tag = None
+                self.reasoning_seconds += time.monotonic() - self._reasoning_started_at
+                self._reasoning_started_at = None
+                continue
+
+            tag_start = text.find("<", position)
+            if tag_start < 0:
+                visible.append(text[position:])
+                break
+            visible.append(text[position:tag_start])
+            rest = text[tag_start:tag_start + MAX_HEAD_SIZE]
+            open_tag = next((tag for tag in REASONING_TAGS if rest.startswith(tag)), None)
+            if open_tag:
+                self._close_tag = REASONING_TAGS[open_tag]
+                self._reasoning_started_at = time.monotonic()
+                position = tag_start + len(open_tag)
+            elif any(tag.startswith(rest) for tag in REASONING_TAGS):
+                self._pending = text[tag_start:]
+                break
+            else:
+                visible.append("<")
+                position = tag_start + 1
+
+        return self._emit("".join(visible))
+
+    def _emit(self, text: str) -> str:
+        if not text:
+            return ""
+        if not self._started:
+            self._head = (self._head + text).lstrip()
+            if not self._head:
+                return ""
+            if not self._fence_removed:
+                if self._head.startswith("```"):
+                    if "```json".startswith(self._head):
+                        return ""  # the json tag may continue in the next chunk
+                    self._head = self._head[FENCE_PATTERN.match(self._head).end():].lstrip()
+                    self._fence_removed = True
+                    if not self._head:
+                        return ""
+                elif "```".startswith(self._head):
+                    return ""
+            self._started = True
+            text, self._head = self._head, ""
+
+        text = self._trailing + text
+        body = text.rstrip(" \t\r\n`")
+        self._trailing = text[len(body):]
+        if len(self._trailing) > MAX_TRAILING_HOLD:
+            body += self._trailing[:-MAX_TRAILING_HOLD]
+            self._trailing = self._trailing[-MAX_TRAILING_HOLD:]
+        return self._output(body)
+
+    def _output(self, text: str) -> str:
+        if text:
+            self.output_chars += len(text)
+            if self.first_output_at is None:
+                self.first_output_at = time.monotonic()
+        return text
+
+    def flush(self) -> str:
+        """Return any held-back output once the stream has ended"""
+        tail = self._head if not self._started else self._trailing
+        if not self._started and not self._fence_removed and self._head.startswith("```"):
+            tail = tail[FENCE_PATTERN.match(tail).end():]
+        self._head = self._trailing = ""
+        # Text after an unterminated reasoning tag is reasoning; a partial open tag is output
+        if self._close_tag is None:
+            tail += self._pending
+        self._pending = ""
+        tail = tail.rstrip()
+        if tail.endswith("```"):
+            tail = tail[:-3]
+        return self._output(tail.strip() if not self._started else tail.rstrip())
+
+def filter_reasoning(chunks, reasoning_filter: ReasoningFilter) -> Generator[str, None, None]:
+    """Yield the visible output of a raw chunk stream"""
+    for chunk in chunks:
+        visible = reasoning_filter.feed(chunk)
+        if visible:
+            yield visible
+        if reasoning_filter.reasoning_limit_reached:
+            break
+    tail = reasoning_filter.flush()
+    if tail:
+        yield tail
+
+def create_conversion_stream(client, input_content: str, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000, temperature: float = 0.6, top_p: float = 0.95):
+    """Open a streaming chat completion for a conversion. API errors are raised, not swallowed."""
+    return client.chat.completions.create(
+        messages=build_messages(input_content, json_template),
+        model=model,
+        stream=True,
+        max_completion_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p
+    )
+
+class ConversionCancelled(Exception):
+    """Raised when a conversion is cancelled; `partial` holds what was generated so far"""
+
+    def __init__(self, partial: Optional[dict] = None):
+        super().__init__("Conversion cancelled")
+        self.partial = partial
+
+class CancellationToken:
+    """Cancel an in-flight conversion from another thread
+
+    cancel() closes the attached HTTP stream right away, so a reader blocked waiting
+    for the next chunk is released instead of running on to max_completion_tokens.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._stream = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, stream):
+        with self._lock:
+            self._stream = stream
+        if self.cancelled:
+            close_stream(stream)
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            stream = self._stream
+        if stream is not None:
+            close_stream(stream)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until cancelled or `timeout` passes; returns True if cancelled"""
+        return self._event.wait(timeout)
+
+def close_stream(stream):
+    """Close a completion stream and its HTTP connection, ignoring errors"""
+    if hasattr(stream, "close"):
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+def tokens_saved(max_tokens: int, metrics: dict) -> int:
+    """Estimate the completion tokens a cancelled conversion did not generate"""
+    return max(0, max_tokens - metrics.get("reasoning_tokens", 0) - metrics.get("output_tokens", 0))
+
+def iter_stream_content(stream, usage: Optional[dict] = None, cancel_token: Optional[CancellationToken] = None) -> Generator[str, None, None]:
+    """Yield content deltas from a completion stream, recording token usage into `usage` if reported"""
+    try:
+        for chunk in stream:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise ConversionCancelled()
+            chunk_usage = getattr(chunk, "usage", None)
+            if usage is not None and chunk_usage is not None:
+                usage["prompt_tokens"] = getattr(chunk_usage, "prompt_tokens", None)
+                usage["completion_tokens"] = getattr(chunk_usage, "completion_tokens", None)
+                usage["total_tokens"] = getattr(chunk_usage, "total_tokens", None)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except ConversionCancelled:
+        raise
+    except Exception:
+        # Closing the stream from another thread surfaces as a read error
+        if cancel_token is not None and cancel_token.cancelled:
+            raise ConversionCancelled()
+        raise
+    if cancel_token is not None and cancel_token.cancelled:
+        raise ConversionCancelled()
+
+def run_conversion(client, input_content: str, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000, temperature: float = 0.6, top_p: float = 0.95, cancel_token: Optional[CancellationToken] = None) -> dict:
+    """Run a conversion to completion and return raw output, cleaned output and usage
+
+    If `cancel_token` is cancelled, the stream is closed and ConversionCancelled is raised
+    with the partial result.
+    """
+    usage = {}
+    raw_chunks = []
+    output_chunks = []
+    reasoning_filter = ReasoningFilter()
+    stream = create_conversion_stream(client, input_content, json_template, model, max_tokens, temperature, top_p)
+    if cancel_token is not None:
+        cancel_token.attach(stream)
+
+    def capture():
+        for chunk in iter_stream_content(stream, usage, cancel_token):
+            raw_chunks.append(chunk)
+            yield chunk
+
+    def result() -> dict:
+        return {
+            "raw_response": "".join(raw_chunks),
+            "cleaned_response": "".join(output_chunks),
+            "usage": usage,
+            "metrics": reasoning_filter.metrics()
+        }
+
+    try:
+        for visible in filter_reasoning(capture(), reasoning_filter):
+            output_chunks.append(visible)
+    except ConversionCancelled:
+        close_stream(stream)
+        tail = reasoning_filter.flush()
+        if tail:
+            output_chunks.append(tail)
+        partial = result()
+        partial["metrics"]["cancelled"] = True
+        partial["metrics"]["tokens_saved"] = tokens_saved(max_tokens, partial["metrics"])
+        raise ConversionCancelled(partial)
+    return result()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Hoist repeated element styles into Bricks global classes
+
+Converted trees often repeat the same style settings (`_padding`, `_borderRadius`,
+`_background`, ...) on many elements. This pass hashes each element's style settings,
+moves every combination used at least `threshold` times into a global class, and
+replaces it on the elements with a `_cssGlobalClasses` reference.
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import sys
+from collections import Counter, defaultdict
+from typing import Iterator, List, Optional, Tuple
+
+# Keys that identify, reference or add behaviour to an element rather than style it
+NON_HOISTABLE_KEYS = {"_cssGlobalClasses", "_cssId", "_cssClasses", "_attributes", "_hidden", "_interactions", "_conditions"}
+# Bytes of a class's id/name lines in the "globalClasses" list, besides its settings
+CLASS_OVERHEAD = 60
+
+def iter_elements(node, level: int = 0) -> Iterator[Tuple[dict, int]]:
+    """Yield (element, nesting level) for every element of a Bricks tree (nested "elements" or flat "content" lists)"""
+    if isinstance(node, list):
+        for item in node:
+            yield from iter_elements(item, level + 1)
+    elif isinstance(node, dict):
+        if "settings" in node or "name" in node:
+            yield node, level
+        for key in ("elements", "content"):
+            if isinstance(node.get(key), list):
+                yield from iter_elements(node[key], level + 1)
+
+def style_settings(element: dict) -> dict:
+    """Return the hoistable style settings of an element"""
+    settings = element.get("settings")
+    if not isinstance(settings, dict):
+        return {}
+    return {key: value for key, value in settings.items() if key.startswith("_") and key not in NON_HOISTABLE_KEYS}
+
+def style_fingerprint(style: dict) -> str:
+    return hashlib.sha256(json.dumps(style, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def settings_cost(settings: dict, level: int) -> int:
+    """Bytes that `settings` entries take in indent=2 output when their keys sit at `level`"""
+    lines = json.dumps(settings, indent=2, ensure_ascii=False).split("\n")[1:-1]
+    return sum(len(line.encode("utf-8")) + 1 + (level - 1) * 2 for line in lines)
+
+def payload_size(bricks_json) -> int:
+    return len(json.dumps(bricks_json, indent=2, ensure_ascii=False).encode("utf-8"))
+
+def hoist_global_classes(bricks_json, threshold: int = 3) -> tuple:
+    """Return (new_json, report) with repeated style settings moved into global classes
+
+    The input is not modified. Classes are added to the top-level "globalClasses" list
+    (a top-level element list is wrapped as {"content": [...], "globalClasses": [...]}).
+    Raises ValueError if the root is not an object or a list.
+    """
+    if not isinstance(bricks_json, (dict, list)):
+        raise ValueError(f"Expected a Bricks JSON object or element list, got {type(bricks_json).__name__}")
+    result = copy.deepcopy(bricks_json)
+    if isinstance(result, list):
+        result = {"content": result}
+
+    styles = {}
+    counts = Counter()
+    savings = Counter()
+    names = defaultdict(Counter)
+    reference = {"_cssGlobalClasses": ["abc123"]}
+    for element, level in iter_elements(result):
+        style = style_settings(element)
+        if not style:
+            continue
+        fingerprint = style_fingerprint(style)
+        styles[fingerprint] = style
+        counts[fingerprint] += 1
+        # Settings keys are indented two levels below their element
+        savings[fingerprint] += settings_cost(style, level + 2) - settings_cost(reference, level + 2)
+        names[fingerprint][element.get("name", "element")] += 1
+
+    global_classes = result.setdefault("globalClasses", [])
+    used_ids = {entry.get("id") for entry in global_classes}
+    used_names = {entry.get("name") for entry in global_classes}
+    class_ids = {}
+    for fingerprint, count in counts.most_common():
+        if count < threshold:
+            break
+        if savings[fingerprint] <= settings_cost(styles[fingerprint], 4) + CLASS_OVERHEAD:
+            continue  # the class definition would cost more than it saves
+        class_id = fingerprint[:6]
+        offset = 6
+        while class_id in used_ids:
+            class_id = fingerprint[offset:offset + 6]
+            offset += 6
+        base_name = names[fingerprint].most_common(1)[0][0]
+        number = 1
+        while f"{base_name}-{number}" in used_names:
+            number += 1
+        used_ids.add(class_id)
+        used_names.add(f"{base_name}-{number}")
+        class_ids[fingerprint] = class_id
+        global_classes.append({"id": class_id, "name": f"{base_name}-{number}", "settings": styles[fingerprint]})
+
+    elements_updated = 0
+    for element, _ in iter_elements(result):
+        style = style_settings(element)
+        class_id = class_ids.get(style_fingerprint(style)) if style else None
+        if not class_id:
+            continue
+        settings = element["settings"]
+        for key in style:
+            del settings[key]
+        settings.setdefault("_cssGlobalClasses", []).append(class_id)
+        elements_updated += 1
+
+    if not global_classes:
+        del result["globalClasses"]
+
+    bytes_before = payload_size(bricks_json)
+    bytes_after = payload_size(result)
+    report = {
+        "classes_created": len(class_ids),
+        "elements_updated": elements_updated,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "reduction_percent": round((1 - bytes_after / bytes_before) * 100, 1) if bytes_before else 0.0
+    }
+    return result, report
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Hoist global classes in a Bricks JSON file from the command line"""
+    parser = argparse.ArgumentParser(description="Move repeated element styles into Bricks global classes")
+    parser.add_argument("input", help="Bricks JSON file")
+    parser.add_argument("-o", "--output", help="Output file (default: overwrite input)")
+    parser.add_argument("--threshold", type=int, default=3, help="Minimum number of elements sharing a style")
+    args = parser.parse_args(argv)
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        bricks_json = json.load(f)
+    try:
+        result, report = hoist_global_classes(bricks_json, args.threshold)
+    except ValueError as e:
+        print(f"❌ {str(e)}")
+        return 1
+    with open(args.output or args.input, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print(f"🎨 {report['classes_created']} global classes created, {report['elements_updated']} elements updated")
+    print(f"📉 {report['bytes_before']:,} → {report['bytes_after']:,} bytes ({report['reduction_percent']}% smaller)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
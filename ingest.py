@@ -0,0 +1,257 @@
+"""
+Streamed ingestion of large HTML files
+
+Files are read in chunks and fed through an incremental HTML parser. While streaming,
+scripts and comments are dropped, whitespace is collapsed (except inside <pre> and
+<textarea>) and the result is written to a spool file on disk, and an index of the
+page's top-level sections is built. Only the parser's small lookahead buffer and the
+section index are kept in memory; previews and sections are read back from the spool
+file on demand.
+"""
+
+import codecs
+import os
+import re
+import uuid
+from html.parser import HTMLParser
+from typing import BinaryIO, Iterable, List, Optional
+
+INGEST_DIR = "_uploads"
+CHUNK_SIZE = 64 * 1024
+PREVIEW_SIZE = 20_000
+SKIPPED_CONTENT = {"script", "noscript", "template"}
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr"
+}
+WHITESPACE = re.compile(r"\s+")
+PRESERVE_WHITESPACE = {"pre", "textarea"}
+# Start tags that implicitly close an open <p>, as in the HTML parsing rules
+CLOSES_PARAGRAPH = {
+    "address", "article", "aside", "blockquote", "details", "dialog", "div", "dl", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+    "hgroup", "hr", "main", "menu", "nav", "ol", "p", "pre", "section", "table", "ul"
+}
+# Elements whose end tag may be omitted, and the start tags that close them
+IMPLIED_END_TAGS = {
+    "li": {"li"},
+    "dt": {"dt", "dd"},
+    "dd": {"dt", "dd"},
+    "option": {"option", "optgroup"},
+    "tr": {"tr"},
+    "td": {"td", "th", "tr"},
+    "th": {"td", "th", "tr"}
+}
+
+class _PreprocessingParser(HTMLParser):
+    """Re-emit HTML without scripts and comments, recording top-level section offsets
+
+    Only end tags that are in the source are written, so the output keeps the source's
+    structure; elements whose end tag is implied (e.g. <li>, <p>) are tracked the way
+    an HTML parser closes them.
+    """
+
+    def __init__(self, output: BinaryIO):
+        super().__init__(convert_charrefs=False)
+        self.output = output
+        self.position = 0
+        self.stack = []
+        self.body_depth = None
+        self.skip_depth = None
+        self.after_space = False  # last output was collapsed whitespace, which may continue in the next chunk
+        # Sections at the first two levels below <body>, so a single wrapper can be looked through
+        self.sections = {1: [], 2: []}
+        self.open_sections = {}
+
+    def _write(self, text: str):
+        data = text.encode("utf-8")
+        self.output.write(data)
+        self.position += len(data)
+        self.after_space = False
+
+    def _section_level(self) -> Optional[int]:
+        if "head" in self.stack:
+            # Without a <body>, <head> would otherwise be indexed like a section
+            return None
+        base = self.body_depth if self.body_depth is not None else 0
+        level = len(self.stack) - base
+        return level if level in self.sections else None
+
+    def _pop(self, end_tag_in_source: bool):
+        depth = len(self.stack)
+        open_tag = self.stack.pop()
+        if self.skip_depth is None:
+            if end_tag_in_source:
+                self._write(f"</{open_tag}>")
+            section = self.open_sections.pop(depth, None)
+            if section:
+                section["end"] = self.position
+                self.sections[section["level"]].append(section)
+        elif depth - 1 == self.skip_depth:
+            self.skip_depth = None
+        if open_tag == "body":
+            self.body_depth = None
+
+    def _close_implied(self, tag: str):
+        while self.stack and len(self.stack) - 1 != self.skip_depth:
+            open_tag = self.stack[-1]
+            if (open_tag == "p" and tag in CLOSES_PARAGRAPH) or tag in IMPLIED_END_TAGS.get(open_tag, ()):
+                self._pop(end_tag_in_source=False)
+            else:
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self._close_implied(tag)
+        if self.skip_depth is not None:
+            if tag not in VOID_ELEMENTS:
+                self.stack.append(tag)
+            return
+        if tag in SKIPPED_CONTENT:
+            self.skip_depth = len(self.stack)
+            self.stack.append(tag)
+            return
+
+        start = self.position
+        self._write(self.get_starttag_text())
+        if tag in VOID_ELEMENTS:
+            return
+        self.stack.append(tag)
+        if tag == "body":
+            # Anything indexed in <head> is not a section
+            self.body_depth = len(self.stack)
+            self.sections = {1: [], 2: []}
+            self.open_sections = {}
+            return
+        level = self._section_level()
+        if level is not None:
+            attributes = dict(attrs)
+            self.open_sections[len(self.stack)] = {
+                "tag": tag,
+                "id": attributes.get("id") or "",
+                "class": attributes.get("class") or "",
+                "start": start,
+                "end": None,
+                "level": level
+            }
+
+    def handle_startendtag(self, tag, attrs):
+        if self.skip_depth is None:
+            self._write(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        # Elements still open inside this one end here without an end tag of their own
+        while self.stack[-1] != tag:
+            self._pop(end_tag_in_source=False)
+        self._pop(end_tag_in_source=True)
+
+    def handle_data(self, data):
+        if self.skip_depth is None:
+            if PRESERVE_WHITESPACE.intersection(self.stack):
+                self._write(data)
+            else:
+                collapsed = WHITESPACE.sub(" ", data)
+                if self.after_space and collapsed.startswith(" "):
+                    collapsed = collapsed[1:]
+                if collapsed:
+                    self._write(collapsed)
+                    self.after_space = collapsed.endswith(" ")
+
+    def handle_entityref(self, name):
+        if self.skip_depth is None:
+            self._write(f"&{name};")
+
+    def handle_charref(self, name):
+        if self.skip_depth is None:
+            self._write(f"&#{name};")
+
+    def handle_decl(self, decl):
+        self._write(f"<!{decl}>")
+
+    def close(self):
+        super().close()
+        for depth, section in self.open_sections.items():
+            section["end"] = self.position
+            self.sections[section["level"]].append(section)
+        self.open_sections = {}
+
+class IngestedDocument:
+    """A preprocessed document spooled to disk with its section index"""
+
+    def __init__(self, name: str, path: str, source_size: int, sections: List[dict]):
+        self.name = name
+        self.path = path
+        self.source_size = source_size
+        self.sections = sections
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def read(self, section: Optional[int] = None) -> str:
+        """Read the whole preprocessed document, or just one section"""
+        with open(self.path, 'rb') as f:
+            if section is None:
+                return f.read().decode("utf-8")
+            f.seek(self.sections[section]["start"])
+            return f.read(self.sections[section]["end"] - self.sections[section]["start"]).decode("utf-8")
+
+    def preview(self, size: int = PREVIEW_SIZE, section: Optional[int] = None) -> str:
+        """Read the first `size` bytes of the document or a section"""
+        start = self.sections[section]["start"] if section is not None else 0
+        end = self.sections[section]["end"] if section is not None else self.size
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(min(size, end - start)).decode("utf-8", errors="ignore")
+
+    def section_label(self, section: int) -> str:
+        entry = self.sections[section]
+        label = f"<{entry['tag']}"
+        if entry["id"]:
+            label += f" #{entry['id']}"
+        if entry["class"]:
+            label += f" .{entry['class'].split()[0]}"
+        return f"{label}> ({(entry['end'] - entry['start']) / 1024:,.1f} KB)"
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def ingest_chunks(chunks: Iterable[bytes], name: str, ingest_dir: str = INGEST_DIR) -> IngestedDocument:
+    """Preprocess a stream of byte chunks into a spool file and index its sections"""
+    if not os.path.exists(ingest_dir):
+        os.makedirs(ingest_dir)
+    path = os.path.join(ingest_dir, f"{uuid.uuid4().hex}.html")
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    source_size = 0
+
+    with open(path, 'wb') as output:
+        parser = _PreprocessingParser(output)
+        for chunk in chunks:
+            source_size += len(chunk)
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+
+    sections = parser.sections[1]
+    if len(sections) == 1 and parser.sections[2]:
+        sections = parser.sections[2]
+    sections.sort(key=lambda section: section["start"])
+    return IngestedDocument(name, path, source_size, sections)
+
+def iter_file_chunks(fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def ingest_file(fileobj: BinaryIO, name: str, ingest_dir: str = INGEST_DIR) -> IngestedDocument:
+    """Ingest an open binary file (e.g. a Streamlit upload)"""
+    return ingest_chunks(iter_file_chunks(fileobj), name, ingest_dir)
+
+def ingest_path(path: str, ingest_dir: str = INGEST_DIR) -> IngestedDocument:
+    """Ingest a file from the local filesystem"""
+    with open(path, 'rb') as f:
+        return ingest_file(f, os.path.basename(path), ingest_dir)
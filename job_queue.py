@@ -0,0 +1,653 @@
+"""
+Persistent conversion job queue with a rate-limit-aware worker pool
+
+Jobs are stored in a local SQLite database so bulk migrations survive restarts.
+A pool of worker threads pulls jobs in priority order (interactive before batch),
+waits on per-model token buckets for requests/minute and tokens/minute, and
+adapts its concurrency when the provider answers with 429 or 5xx errors. Claimed
+jobs are leased to their scheduler, so a second scheduler on the same database
+never picks up a job that is still running elsewhere.
+"""
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from conversion import CancellationToken, ConversionCancelled, build_user_prompt, estimate_tokens, run_conversion
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+# Conservative defaults; adjust to the quota of your Cerebras account
+DEFAULT_RATE_LIMITS = {
+    "default": {"requests_per_minute": 30, "tokens_per_minute": 60000}
+}
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# A running job whose owner has not renewed its lease for this long is assumed orphaned
+DEFAULT_LEASE_SECONDS = 60.0
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `capacity` units per minute"""
+
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units now, going into debt if needed, and return the seconds until they are covered"""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def try_take(self, amount: float) -> float:
+        """Take `amount` units only if they are available; otherwise return the seconds until they will be"""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def adjust(self, amount: float):
+        """Give back (positive) or charge extra (negative) units after the real cost is known"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the provider reported that the quota is exhausted"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+class RateLimiter:
+    """Per-model request and token buckets
+
+    Interactive requests reserve() their units at once and may put a bucket into debt,
+    so they only wait for their own cost. Batch requests acquire() units only once they
+    are actually available, so they wait behind any interactive debt instead of ahead
+    of it.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, int]]] = None):
+        self.limits = dict(DEFAULT_RATE_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.buckets = {}
+        self.blocked_until = {}
+        self.lock = threading.Lock()
+        self.take_lock = threading.Lock()  # takes from both buckets of a model together
+
+    def _buckets(self, model: str):
+        with self.lock:
+            if model not in self.buckets:
+                limit = self.limits.get(model, self.limits["default"])
+                self.buckets[model] = (
+                    TokenBucket(limit["requests_per_minute"]),
+                    TokenBucket(limit["tokens_per_minute"])
+                )
+            return self.buckets[model]
+
+    def acquire(self, model: str, tokens: int, stop_event: Optional[threading.Event] = None) -> bool:
+        """Block until one request and `tokens` tokens are available for `model`, then take them
+
+        Returns False, having taken nothing, if `stop_event` (anything with a wait(timeout)
+        method) is set first.
+        """
+        requests_bucket, tokens_bucket = self._buckets(model)
+        while True:
+            wait = self.blocked_until.get(model, 0.0) - time.monotonic()
+            if wait <= 0:
+                with self.take_lock:
+                    wait = requests_bucket.try_take(1)
+                    if wait <= 0:
+                        wait = tokens_bucket.try_take(tokens)
+                        if wait <= 0:
+                            return True
+                        requests_bucket.adjust(1)
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def reserve(self, model: str, tokens: int) -> float:
+        """Take one request and `tokens` tokens for an interactive request right away
+
+        Returns the seconds to wait before sending it. Batch requests waiting in acquire()
+        queue up behind this reservation.
+        """
+        requests_bucket, tokens_bucket = self._buckets(model)
+        with self.take_lock:
+            wait = max(requests_bucket.reserve(1), tokens_bucket.reserve(tokens))
+        return max(wait, self.blocked_until.get(model, 0.0) - time.monotonic())
+
+    def release(self, model: str, tokens: int):
+        """Give back units that were taken for a request that was never sent"""
+        requests_bucket, tokens_bucket = self._buckets(model)
+        requests_bucket.adjust(1)
+        tokens_bucket.adjust(min(float(tokens), tokens_bucket.capacity))
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Reconcile the token bucket with the usage reported by the API"""
+        if actual_tokens is None:
+            return
+        _, tokens_bucket = self._buckets(model)
+        tokens_bucket.adjust(estimated_tokens - actual_tokens)
+
+    def throttle(self, model: str, delay: float):
+        """Pause all requests for `model` for `delay` seconds and drain its buckets"""
+        requests_bucket, tokens_bucket = self._buckets(model)
+        requests_bucket.drain()
+        tokens_bucket.drain()
+        with self.lock:
+            self.blocked_until[model] = max(self.blocked_until.get(model, 0.0), time.monotonic() + delay)
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit: grows by one slot per window of successes, halves on throttling"""
+
+    def __init__(self, max_workers: int, initial: Optional[int] = None):
+        self.max_workers = max_workers
+        self.limit = float(initial or max_workers)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, stop_event: threading.Event) -> bool:
+        with self.condition:
+            while self.active >= int(self.limit):
+                if stop_event.is_set():
+                    return False
+                self.condition.wait(timeout=0.5)
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            self.limit = min(float(self.max_workers), self.limit + 1.0 / max(self.limit, 1.0))
+            self.condition.notify_all()
+
+    def on_throttle(self):
+        with self.condition:
+            self.limit = max(1.0, self.limit / 2.0)
+
+def error_status_code(error: Exception) -> Optional[int]:
+    """Extract an HTTP status code from an SDK exception, if any"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and connection problems are worth retrying"""
+    status_code = error_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectionError", "TimeoutError")
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read a Retry-After header from an SDK exception, if present"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def backoff_delay(attempt: int, base: float = 2.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def estimate_request_tokens(input_content: str, json_template: str, max_tokens: int) -> int:
+    """Tokens to reserve for a request: the prompt estimate plus the full completion budget"""
+    return estimate_tokens(build_user_prompt(input_content, json_template)) + max_tokens
+
+def api_key_id(api_key: str) -> str:
+    """Non-secret identifier stored with a job instead of the API key itself"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+class JobQueue:
+    """Durable job store backed by SQLite
+
+    Each JobQueue instance is a separate owner. A claimed job is leased to its owner,
+    which must renew the lease while the job runs; jobs whose lease ran out (their
+    process or scheduler is gone) are claimed again by any other owner. Jobs record the
+    id of the API key they need, and an owner only claims jobs whose key it holds.
+
+    Requires SQLite 3.24 or newer (WAL mode and UPDATE with subqueries).
+    """
+
+    def __init__(self, db_path: str = os.path.join("_queue", "jobs.db"), lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    priority INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    not_before REAL NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    api_key_id TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            # Databases created before leases and API key ids were added
+            columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            if "lease_until" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+            if "api_key_id" not in columns:
+                self.conn.execute("ALTER TABLE jobs ADD COLUMN api_key_id TEXT")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, created_at)")
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _update(self, sql: str, params: tuple = ()) -> int:
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).rowcount
+
+    def submit(self, payload: dict, priority: int = PRIORITY_BATCH, api_key_id: Optional[str] = None) -> str:
+        """Add a conversion job and return its id
+
+        `api_key_id` is the id of the API key the job must run with (see api_key_id());
+        only owners that hold that key claim it.
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        self._execute(
+            "INSERT INTO jobs (id, priority, status, payload, api_key_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, priority, STATUS_QUEUED, json.dumps(payload, ensure_ascii=False), api_key_id, now, now)
+        )
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Return the job's metadata (without payload or result), or None if unknown"""
+        rows = self._execute(
+            "SELECT id, priority, status, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)
+        )
+        return dict(rows[0]) if rows else None
+
+    def result(self, job_id: str) -> Optional[dict]:
+        """Return the stored result of a completed job"""
+        rows = self._execute("SELECT result FROM jobs WHERE id = ?", (job_id,))
+        if not rows or rows[0]["result"] is None:
+            return None
+        return json.loads(rows[0]["result"])
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if it already finished."""
+        updated = self._update(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (STATUS_CANCELLED, datetime.now().isoformat(), job_id, STATUS_QUEUED, STATUS_RUNNING)
+        )
+        return bool(updated)
+
+    def list_jobs(self, limit: int = 50, api_key_id: Optional[str] = None) -> List[dict]:
+        """Most recent jobs first, optionally only those submitted with the given API key id"""
+        if api_key_id is not None:
+            rows = self._execute(
+                "SELECT id, priority, status, error, attempts, created_at, updated_at FROM jobs WHERE api_key_id = ? ORDER BY created_at DESC LIMIT ?",
+                (api_key_id, limit)
+            )
+        else:
+            rows = self._execute(
+                "SELECT id, priority, status, error, attempts, created_at, updated_at FROM jobs ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            )
+        return [dict(row) for row in rows]
+
+    def claim_next(self, api_key_ids=()) -> Optional[dict]:
+        """Atomically lease the highest-priority runnable job to this owner and return it
+
+        Runnable jobs are queued jobs that are due, and running jobs whose owner's lease
+        has expired (e.g. the process that claimed them was stopped). Only jobs without an
+        API key or with one of `api_key_ids` are considered.
+        """
+        api_key_ids = list(api_key_ids)
+        key_filter = "api_key_id IS NULL"
+        if api_key_ids:
+            key_filter += f" OR api_key_id IN ({', '.join('?' * len(api_key_ids))})"
+        now = time.time()
+        with self.lock:
+            # BEGIN IMMEDIATE takes the write lock before reading, so two owners cannot pick the same job
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"""
+                    SELECT id, priority, payload, attempts, api_key_id FROM jobs
+                    WHERE ((status = ? AND not_before <= ?) OR (status = ? AND lease_until < ?)) AND ({key_filter})
+                    ORDER BY priority, created_at LIMIT 1
+                    """,
+                    (STATUS_QUEUED, now, STATUS_RUNNING, now, *api_key_ids)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                        (STATUS_RUNNING, self.owner, now + self.lease_seconds, datetime.now().isoformat(), row["id"])
+                    )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def cancelled_ids(self, job_ids: List[str]) -> List[str]:
+        """Return which of `job_ids` are cancelled"""
+        if not job_ids:
+            return []
+        rows = self._execute(
+            f"SELECT id FROM jobs WHERE status = ? AND id IN ({', '.join('?' * len(job_ids))})",
+            (STATUS_CANCELLED, *job_ids)
+        )
+        return [row["id"] for row in rows]
+
+    def renew_leases(self) -> int:
+        """Extend the lease of every job this owner is running; returns how many were renewed"""
+        return self._update(
+            "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+            (time.time() + self.lease_seconds, self.owner, STATUS_RUNNING)
+        )
+
+    def _finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None,
+                not_before: float = 0.0, attempt_used: bool = True) -> bool:
+        # Only jobs this owner is still running are updated, so a cancel issued meanwhile
+        # or a takeover after an expired lease is not overwritten
+        updated = self._update(
+            """
+            UPDATE jobs SET status = ?, result = ?, error = ?, not_before = ?, attempts = attempts - ?, owner = NULL, updated_at = ?
+            WHERE id = ? AND status = ? AND owner = ?
+            """,
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, not_before,
+             0 if attempt_used else 1, datetime.now().isoformat(), job_id, STATUS_RUNNING, self.owner)
+        )
+        return bool(updated)
+
+    def record_partial(self, job_id: str, result: dict) -> bool:
+        """Store the partial output of a job that was cancelled while running"""
+        updated = self._update(
+            "UPDATE jobs SET result = ?, updated_at = ? WHERE id = ? AND status = ? AND owner = ?",
+            (json.dumps(result, ensure_ascii=False), datetime.now().isoformat(), job_id, STATUS_CANCELLED, self.owner)
+        )
+        return bool(updated)
+
+    def complete(self, job_id: str, result: dict) -> bool:
+        return self._finish(job_id, STATUS_COMPLETED, result=result)
+
+    def fail(self, job_id: str, error: str) -> bool:
+        return self._finish(job_id, STATUS_FAILED, error=error)
+
+    def retry_later(self, job_id: str, delay: float, error: str) -> bool:
+        return self._finish(job_id, STATUS_QUEUED, error=error, not_before=time.time() + delay)
+
+    def release(self, job_id: str, delay: float = 0.0, reason: Optional[str] = None) -> bool:
+        """Put a claimed job back without counting the attempt (it was never sent)"""
+        return self._finish(job_id, STATUS_QUEUED, error=reason, not_before=time.time() + delay, attempt_used=False)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def default_convert(client, payload: dict, cancel_token: Optional[CancellationToken] = None) -> dict:
+    """Run a queued conversion with the shared conversion helpers"""
+    return run_conversion(
+        client,
+        payload["input_content"],
+        payload["json_template"],
+        payload.get("model", "llama-3.3-70b"),
+        payload.get("max_tokens", 8000),
+        payload.get("temperature", 0.6),
+        payload.get("top_p", 0.95),
+        cancel_token
+    )
+
+# The scheduler currently draining each queue database in this process
+_active_schedulers = {}
+_active_schedulers_lock = threading.Lock()
+
+class ConversionScheduler:
+    """Worker pool that drains a JobQueue within per-model rate limits
+
+    Jobs store only an id of their API key (see register_api_key()); the key itself is
+    kept in memory and passed to `client_factory(api_key)` when the job runs, and only
+    jobs whose key was registered here are claimed. Starting a scheduler stops any
+    scheduler this process was already running on the same database.
+    """
+
+    def __init__(self, queue: JobQueue, client_factory: Callable, max_workers: int = 4,
+                 rate_limits: Optional[Dict[str, Dict[str, int]]] = None, max_attempts: int = 5,
+                 convert: Callable = default_convert, poll_interval: float = 0.5):
+        self.queue = queue
+        self.client_factory = client_factory
+        self.convert = convert
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.limiter = RateLimiter(rate_limits)
+        self.concurrency = AdaptiveConcurrency(max_workers)
+        self.stop_event = threading.Event()
+        self.api_keys = {}
+        self.cancel_tokens = {}
+        self.waiting_jobs = set()  # jobs waiting on the rate limiter
+        self.cancel_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"conversion-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        self.threads.append(threading.Thread(target=self._heartbeat, name="conversion-lease-heartbeat", daemon=True))
+
+    def start(self):
+        with _active_schedulers_lock:
+            key = os.path.abspath(self.queue.db_path)
+            previous = _active_schedulers.get(key)
+            if previous is not None and previous is not self:
+                # Its running jobs finish (and keep their leases); it just stops claiming new ones
+                previous.stop_event.set()
+            _active_schedulers[key] = self
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self.stop_event.set()
+        # Wake jobs waiting on the rate limiter; they go back to the queue unsent
+        with self.cancel_lock:
+            waiting = [self.cancel_tokens[job_id] for job_id in self.waiting_jobs]
+        for token in waiting:
+            token.cancel()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def register_api_key(self, api_key: str) -> str:
+        """Make an API key available to this scheduler's jobs and return the id to submit them with"""
+        key_id = api_key_id(api_key)
+        self.api_keys[key_id] = api_key
+        return key_id
+
+    def submit(self, payload: dict, interactive: bool = False, api_key: Optional[str] = None) -> str:
+        key_id = self.register_api_key(api_key) if api_key else None
+        return self.queue.submit(payload, PRIORITY_INTERACTIVE if interactive else PRIORITY_BATCH, key_id)
+
+    def reserve_interactive(self, model: str, estimated_tokens: int) -> float:
+        """Charge a request made outside the queue (e.g. a live UI conversion) to the shared rate limits
+
+        The request goes ahead of queued jobs waiting on the limiter. Returns the seconds
+        to wait before sending it; give the reservation back with limiter.release() if it
+        is abandoned.
+        """
+        return self.limiter.reserve(model, estimated_tokens)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; a job waiting on the rate limiter is woken and a running job's HTTP stream is closed immediately"""
+        cancelled = self.queue.cancel(job_id)
+        with self.cancel_lock:
+            token = self.cancel_tokens.get(job_id)
+        if token is not None:
+            token.cancel()
+        return cancelled
+
+    def _cancel_cancelled(self):
+        """Cancel the tokens of this scheduler's jobs that were cancelled in the database, e.g. by another process"""
+        with self.cancel_lock:
+            job_ids = list(self.cancel_tokens)
+        for job_id in self.queue.cancelled_ids(job_ids):
+            with self.cancel_lock:
+                token = self.cancel_tokens.get(job_id)
+            if token is not None:
+                token.cancel()
+
+    def _heartbeat(self):
+        # Keep renewing leases until stopped and the last running job has finished
+        interval = self.queue.lease_seconds / 3
+        check_interval = min(interval, self.poll_interval)
+        renewed_at = time.monotonic()
+        while not self.stop_event.wait(check_interval):
+            self._cancel_cancelled()
+            if time.monotonic() - renewed_at >= interval:
+                self.queue.renew_leases()
+                renewed_at = time.monotonic()
+        while self.concurrency.active:
+            self.queue.renew_leases()
+            self._cancel_cancelled()
+            time.sleep(check_interval)
+
+    def _worker(self):
+        while not self.stop_event.is_set():
+            if not self.concurrency.acquire(self.stop_event):
+                return
+            try:
+                job = self.queue.claim_next(list(self.api_keys))
+                if job is None:
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                self._run_job(job)
+            finally:
+                self.concurrency.release()
+
+    def handle_error(self, model: str, error: Exception, attempts: int) -> Optional[float]:
+        """Apply throttling for a failed request; return the retry delay, or None if it should not be retried"""
+        if not is_retryable(error) or attempts >= self.max_attempts:
+            return None
+        status_code = error_status_code(error)
+        if status_code == 429 or (status_code is not None and status_code >= 500):
+            self.concurrency.on_throttle()
+        retry_after = retry_after_seconds(error)
+        delay = retry_after if retry_after is not None else backoff_delay(attempts)
+        if status_code == 429:
+            self.limiter.throttle(model, delay)
+        return delay
+
+    def _run_job(self, job: dict):
+        payload = job["payload"]
+        model = payload.get("model", "llama-3.3-70b")
+        # claim_next() only hands out jobs without a key or with one registered here
+        api_key = self.api_keys.get(job["api_key_id"]) if job["api_key_id"] else None
+        estimated_tokens = estimate_request_tokens(payload["input_content"], payload["json_template"], payload.get("max_tokens", 8000))
+
+        # Registered before waiting on the rate limiter so cancel() and stop() can wake the wait
+        token = CancellationToken()
+        with self.cancel_lock:
+            self.cancel_tokens[job["id"]] = token
+            self.waiting_jobs.add(job["id"])
+        if self.queue.status(job["id"])["status"] == STATUS_CANCELLED or self.stop_event.is_set():
+            # Cancelled or stopped before the token was registered
+            token.cancel()
+        acquired = self.limiter.acquire(model, estimated_tokens, token)
+        if acquired and token.cancelled:
+            self.limiter.release(model, estimated_tokens)
+            acquired = False
+        with self.cancel_lock:
+            self.waiting_jobs.discard(job["id"])
+        if not acquired:
+            with self.cancel_lock:
+                self.cancel_tokens.pop(job["id"], None)
+            if self.queue.status(job["id"])["status"] != STATUS_CANCELLED:
+                self.queue.release(job["id"], 0, "Scheduler stopped")
+            return
+        try:
+            result = self.convert(self.client_factory(api_key), payload, cancel_token=token)
+        except ConversionCancelled as e:
+            # Give back the completion tokens that were not generated: the usage is rarely
+            # reported before the end of the stream, so estimate it from the partial output
+            partial = e.partial or {}
+            actual_tokens = partial.get("usage", {}).get("total_tokens")
+            if actual_tokens is None:
+                max_tokens = payload.get("max_tokens", 8000)
+                actual_tokens = estimated_tokens - max_tokens + estimate_tokens(partial.get("raw_response", ""))
+            self.limiter.settle(model, estimated_tokens, actual_tokens)
+            if e.partial:
+                self.queue.record_partial(job["id"], e.partial)
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"
+            delay = self.handle_error(model, e, job["attempts"])
+            if delay is not None:
+                self.queue.retry_later(job["id"], delay, error)
+            else:
+                self.queue.fail(job["id"], error)
+            return
+        finally:
+            with self.cancel_lock:
+                self.cancel_tokens.pop(job["id"], None)
+
+        self.limiter.settle(model, estimated_tokens, result.get("usage", {}).get("total_tokens"))
+        self.concurrency.on_success()
+        self.queue.complete(job["id"], result)
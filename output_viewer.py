@@ -0,0 +1,127 @@
+"""
+Memory-bounded view model for large conversion outputs
+
+Large responses are kept as a single canonical string. The cleaned JSON is stored
+as a span into the raw response whenever possible, the JSON tree is parsed once on
+first use, and the UI only ever asks for small slices: one page of raw text or the
+children of one expanded node.
+"""
+
+import json
+from typing import Any, List, Optional, Tuple
+
+from conversion import clean_output
+
+# Outputs larger than this are shown in the tree/page viewer instead of the editors
+LARGE_OUTPUT_THRESHOLD = 200_000
+RAW_PAGE_SIZE = 20_000
+STREAM_TAIL_SIZE = 4_000
+CHILDREN_PAGE_SIZE = 50
+VALUE_PREVIEW_SIZE = 200
+
+Path = Tuple[Any, ...]
+
+class OutputDocument:
+    """One conversion result: raw response, cleaned JSON and parsed tree"""
+
+    def __init__(self, raw_response: str, cleaned_response: Optional[str] = None):
+        self.raw = raw_response
+        cleaned = clean_output(raw_response) if cleaned_response is None else cleaned_response
+        start = raw_response.find(cleaned) if cleaned else 0
+        if start >= 0:
+            # Cleaned output is a slice of the raw response; don't keep a second copy
+            self._span = (start, start + len(cleaned))
+            self._cleaned = None
+        else:
+            self._span = None
+            self._cleaned = cleaned
+        self._tree = None
+        self._parsed = False
+        self.parse_error = None
+
+    @property
+    def cleaned(self) -> str:
+        if self._span is None:
+            return self._cleaned
+        start, end = self._span
+        return self.raw[start:end]
+
+    @property
+    def shares_raw(self) -> bool:
+        """True if the cleaned output is a slice of the raw response rather than a second copy"""
+        return self._span is not None
+
+    @property
+    def cleaned_size(self) -> int:
+        if self._span is None:
+            return len(self._cleaned)
+        return self._span[1] - self._span[0]
+
+    @property
+    def tree(self) -> Optional[Any]:
+        """Parsed cleaned JSON, parsed on first access only. None if it is not valid JSON."""
+        if not self._parsed:
+            self._parsed = True
+            try:
+                self._tree = json.loads(self.cleaned)
+            except json.JSONDecodeError as e:
+                self.parse_error = str(e)
+        return self._tree
+
+    def page_count(self, page_size: int = RAW_PAGE_SIZE) -> int:
+        return max(1, -(-len(self.raw) // page_size))
+
+    def raw_page(self, page: int, page_size: int = RAW_PAGE_SIZE) -> str:
+        """Return one page (0-based) of the raw response"""
+        start = page * page_size
+        return self.raw[start:start + page_size]
+
+    def node_at(self, path: Path) -> Any:
+        node = self.tree
+        for key in path:
+            node = node[key]
+        return node
+
+    def children(self, path: Path, offset: int = 0, limit: int = CHILDREN_PAGE_SIZE) -> List[Tuple[Path, str, bool]]:
+        """Return (path, label, expandable) for a slice of the node's children"""
+        node = self.node_at(path)
+        if isinstance(node, dict):
+            keys = list(node.keys())[offset:offset + limit]
+        elif isinstance(node, list):
+            keys = range(offset, min(len(node), offset + limit))
+        else:
+            return []
+        return [
+            (path + (key,), node_label(key, node[key]), isinstance(node[key], (dict, list)) and len(node[key]) > 0)
+            for key in keys
+        ]
+
+    def child_count(self, path: Path) -> int:
+        node = self.node_at(path)
+        return len(node) if isinstance(node, (dict, list)) else 0
+
+def node_label(key: Any, value: Any) -> str:
+    """Short one-line description of a JSON node, naming Bricks elements by name and id"""
+    if isinstance(value, dict):
+        if "name" in value or "id" in value:
+            nested = value.get("elements") or value.get("children") or []
+            label = f"{key}: {value.get('name', '?')} #{value.get('id', '?')}"
+            return f"{label} ({len(nested)} children)" if nested else label
+        return f"{key}: {{{len(value)} keys}}"
+    if isinstance(value, list):
+        return f"{key}: [{len(value)} items]"
+    preview = json.dumps(value, ensure_ascii=False)
+    if len(preview) > VALUE_PREVIEW_SIZE:
+        preview = preview[:VALUE_PREVIEW_SIZE] + "…"
+    return f"{key}: {preview}"
+
+def stream_tail(chunks: List[str], size: int = STREAM_TAIL_SIZE) -> str:
+    """Return the last `size` characters of a chunked stream without joining all of it"""
+    tail = []
+    length = 0
+    for chunk in reversed(chunks):
+        tail.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            break
+    return "".join(reversed(tail))[-size:]
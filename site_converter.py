@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Whole-site conversion with shared fragment deduplication
+
+Pages of one site usually repeat the same header, nav and footer markup. This module
+splits every page into its top-level fragments, fingerprints them, and converts each
+fragment shared by several pages only once. The rest of each page is converted in
+one call, with a placeholder where each shared fragment goes; the converted fragment
+is then spliced in at its placeholder, either copied with namespaced element IDs or
+as a reference to a template emitted once.
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+from conversion import estimate_tokens, run_conversion
+from ingest import VOID_ELEMENTS
+from job_queue import ConversionScheduler, JobQueue, STATUS_CANCELLED, STATUS_COMPLETED, STATUS_FAILED
+
+MODE_INLINE = "inline"
+MODE_TEMPLATE = "template"
+# Stands in for a shared fragment in a page's markup; the model carries the text through to its output
+PLACEHOLDER = "[[shared-fragment-{index}]]"
+PLACEHOLDER_PATTERN = re.compile(r"\[\[shared-fragment-(\d+)\]\]")
+
+class _SpanParser(HTMLParser):
+    """Record the source span, inner span and children of every element"""
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=False)
+        self.html = html
+        self.line_starts = [0] + [match.end() for match in re.finditer("\n", html)]
+        self.roots = []  # element dicts with tag, start, end, inner_start, inner_end, children
+        self.stack = []
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def _open(self, tag: str, start: int) -> dict:
+        inner_start = start + len(self.get_starttag_text())
+        element = {"tag": tag, "start": start, "end": inner_start, "inner_start": inner_start, "inner_end": inner_start, "children": []}
+        (self.stack[-1]["children"] if self.stack else self.roots).append(element)
+        return element
+
+    def handle_starttag(self, tag, attrs):
+        element = self._open(tag, self._offset())
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self._open(tag, self._offset())
+
+    def handle_endtag(self, tag):
+        if not any(element["tag"] == tag for element in self.stack):
+            return
+        start = self._offset()
+        end = self.html.find(">", start) + 1 or len(self.html)
+        # Elements left open inside this one (e.g. unclosed <p>) end where it ends
+        while self.stack:
+            element = self.stack.pop()
+            element["end"] = end
+            element["inner_end"] = start if element["tag"] == tag else end
+            if element["tag"] == tag:
+                break
+
+    def close(self):
+        super().close()
+        for element in self.stack:
+            element["end"] = element["inner_end"] = len(self.html)
+        self.stack = []
+
+SKIPPED_TAGS = ("head", "script", "style")
+# End tags, comments, doctypes and whitespace carry no content worth converting
+INSIGNIFICANT_MARKUP = re.compile(r"</[^>]*>|<!--.*?-->|<![^>]*>|\s+", re.DOTALL)
+
+def is_significant(markup: str) -> bool:
+    return bool(INSIGNIFICANT_MARKUP.sub("", markup))
+
+def own_text(html: str, element: dict) -> str:
+    """The element's content outside its child elements"""
+    parts = []
+    position = element["inner_start"]
+    for child in element["children"]:
+        parts.append(html[position:child["start"]])
+        position = child["end"]
+    parts.append(html[position:element["inner_end"]])
+    return "".join(parts)
+
+def page_layout(html: str) -> Tuple[Tuple[int, int], List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """Return the page's content span, its fragment spans and the spans to leave out
+
+    The content is the inside of <body> (or of the document if there is none) and
+    fragments are its child elements. A single wrapper element such as <div id="page">
+    without text of its own is looked through, one level only, so that header, main
+    and footer still come out as separate fragments; the wrapper's own markup stays
+    in the content between the fragments. <head>, <script> and <style> are left out.
+    """
+    parser = _SpanParser(html)
+    parser.feed(html)
+    parser.close()
+
+    def find(elements, tag):
+        for element in elements:
+            if element["tag"] == tag:
+                return element
+            found = find(element["children"], tag)
+            if found:
+                return found
+        return None
+
+    container = find(parser.roots, "body") or find(parser.roots, "html")
+    if container:
+        content = (container["inner_start"], container["inner_end"])
+        children = container["children"]
+    else:
+        content = (0, len(html))
+        children = parser.roots
+
+    skipped = [(child["start"], child["end"]) for child in children if child["tag"] in SKIPPED_TAGS]
+    fragments = [child for child in children if child["tag"] not in SKIPPED_TAGS]
+    if len(fragments) == 1 and fragments[0]["children"] and not is_significant(own_text(html, fragments[0])):
+        wrapper = fragments[0]
+        skipped += [(child["start"], child["end"]) for child in wrapper["children"] if child["tag"] in SKIPPED_TAGS]
+        fragments = [child for child in wrapper["children"] if child["tag"] not in SKIPPED_TAGS]
+    return content, [(fragment["start"], fragment["end"]) for fragment in fragments], sorted(skipped)
+
+def split_fragments(html: str) -> List[Tuple[int, int]]:
+    """Return the (start, end) spans of a page's top-level fragments"""
+    return page_layout(html)[1]
+
+def normalize_fragment(fragment: str) -> str:
+    """Collapse whitespace so formatting differences don't change the fingerprint"""
+    fragment = re.sub(r">\s+<", "><", fragment.strip())
+    return re.sub(r"\s+", " ", fragment)
+
+def fingerprint(fragment: str) -> str:
+    return hashlib.sha256(normalize_fragment(fragment).encode("utf-8")).hexdigest()[:16]
+
+def page_markup(html: str, shared: set) -> Tuple[str, List[str]]:
+    """Return the page's content with each shared fragment replaced by a placeholder
+
+    Also returns the fingerprints of the replaced fragments, in placeholder order. The
+    content keeps wrapper markup and loose text, so it is still one well-formed piece of
+    markup; only the shared fragments and the left-out spans are taken out.
+    """
+    (content_start, content_end), fragments, skipped = page_layout(html)
+    cuts = sorted(skipped + [(start, end) for start, end in fragments if fingerprint(html[start:end]) in shared])
+    parts = []
+    fragment_ids = []
+    position = content_start
+    for start, end in cuts:
+        parts.append(html[position:start])
+        if (start, end) not in skipped:
+            parts.append(f"<div>{PLACEHOLDER.format(index=len(fragment_ids))}</div>")
+            fragment_ids.append(fingerprint(html[start:end]))
+        position = end
+    parts.append(html[position:content_end])
+    return "".join(parts).strip(), fragment_ids
+
+def find_shared_fragments(pages: Dict[str, str], min_pages: int = 2) -> Dict[str, dict]:
+    """Return fragments that appear on at least `min_pages` pages, keyed by fingerprint"""
+    fragments = {}
+    for page_name, html in pages.items():
+        for start, end in split_fragments(html):
+            fragment = html[start:end]
+            entry = fragments.setdefault(fingerprint(fragment), {"html": fragment, "pages": []})
+            if page_name not in entry["pages"]:
+                entry["pages"].append(page_name)
+    return {fragment_id: entry for fragment_id, entry in fragments.items() if len(entry["pages"]) >= min_pages}
+
+def namespace_ids(elements: List[dict], namespace: str) -> List[dict]:
+    """Deep-copy elements, suffixing every id (and parent/children references) with `namespace`"""
+    elements = copy.deepcopy(elements)
+    ids = {}
+
+    def collect(items):
+        for element in items:
+            if isinstance(element, dict):
+                if "id" in element:
+                    ids[element["id"]] = f"{element['id']}-{namespace}"
+                collect(element.get("elements") or [])
+
+    def rename(items):
+        for element in items:
+            if not isinstance(element, dict):
+                continue
+            if element.get("id") in ids:
+                element["id"] = ids[element["id"]]
+            if element.get("parent") in ids:
+                element["parent"] = ids[element["parent"]]
+            if isinstance(element.get("children"), list):
+                element["children"] = [ids.get(child, child) for child in element["children"]]
+            rename(element.get("elements") or [])
+
+    collect(elements)
+    rename(elements)
+    return elements
+
+def splice_placeholders(elements: List[dict], replacements: List[List[dict]]) -> List[dict]:
+    """Replace each placeholder element with the elements for its index
+
+    A placeholder element is one whose own fields (not its nested elements) contain a
+    placeholder. Replacement elements take over its parent, and a parent's `children`
+    ids are updated. Raises ValueError if a placeholder is missing from `elements`.
+    """
+    found = {}  # placeholder element id -> ids of the elements replacing it
+
+    def splice(items):
+        spliced = []
+        for element in items:
+            if not isinstance(element, dict):
+                spliced.append(element)
+                continue
+            own = {key: value for key, value in element.items() if key != "elements"}
+            match = PLACEHOLDER_PATTERN.search(json.dumps(own, ensure_ascii=False))
+            if match and int(match.group(1)) < len(replacements) and int(match.group(1)) not in found.values():
+                index = int(match.group(1))
+                inserted = copy.deepcopy(replacements[index])
+                for item in inserted:
+                    if "parent" in element:
+                        item["parent"] = element["parent"]
+                found[element.get("id", f"#{index}")] = index
+                spliced.extend(inserted)
+                continue
+            if isinstance(element.get("elements"), list):
+                element["elements"] = splice(element["elements"])
+            spliced.append(element)
+        return spliced
+
+    elements = splice(elements)
+    missing = set(range(len(replacements))) - set(found.values())
+    if missing:
+        raise ValueError(f"Converted page lost the placeholders of shared fragments {sorted(missing)}")
+
+    def relink(items):
+        for element in items:
+            if not isinstance(element, dict):
+                continue
+            if isinstance(element.get("children"), list):
+                children = []
+                for child in element["children"]:
+                    if child in found:
+                        children.extend(item.get("id") for item in replacements[found[child]] if isinstance(item, dict))
+                    else:
+                        children.append(child)
+                element["children"] = children
+            relink(element.get("elements") or [])
+
+    relink(elements)
+    return elements
+
+def link_templates(bricks_json: dict, template_ids: Dict[str, int]) -> dict:
+    """Point template elements at imported template post IDs instead of `shared-<fingerprint>` names"""
+    def link(items):
+        for element in items:
+            if not isinstance(element, dict):
+                continue
+            settings = element.get("settings")
+            if element.get("name") == "template" and isinstance(settings, dict) and settings.get("template") in template_ids:
+                settings["template"] = template_ids[settings["template"]]
+            link(element.get("elements") or [])
+
+    link(extract_elements(bricks_json))
+    return bricks_json
+
+def extract_elements(bricks_json) -> List[dict]:
+    """Return the element list of a converted fragment"""
+    if isinstance(bricks_json, list):
+        return bricks_json
+    for key in ("elements", "content"):
+        if isinstance(bricks_json.get(key), list):
+            return bricks_json[key]
+    return [bricks_json]
+
+def make_converter(client, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000, temperature: float = 0.6, top_p: float = 0.95) -> Callable[[str], dict]:
+    """Build a fragment converter that calls the API directly and parses the cleaned JSON"""
+    def convert(html: str) -> dict:
+        result = run_conversion(client, html, json_template, model, max_tokens, temperature, top_p)
+        return json.loads(result["cleaned_response"])
+    return convert
+
+class QueuedConverter:
+    """Fragment converter that runs each conversion as a batch job
+
+    The job queue's rate limits, retries and backoff then apply to every fragment.
+    convert_site() submits all conversions first and then collects them, so the
+    scheduler's workers run them in parallel. Calling the converter directly converts
+    one fragment and waits for it.
+    """
+
+    def __init__(self, scheduler: ConversionScheduler, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000,
+                 temperature: float = 0.6, top_p: float = 0.95, api_key: Optional[str] = None, poll_interval: float = 0.5):
+        self.scheduler = scheduler
+        self.json_template = json_template
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.api_key = api_key
+        self.poll_interval = poll_interval
+
+    def submit(self, html: str) -> str:
+        """Queue a conversion and return its job id"""
+        return self.scheduler.submit({
+            "input_content": html,
+            "json_template": self.json_template,
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p
+        }, api_key=self.api_key)
+
+    def result(self, job_id: str) -> dict:
+        """Wait for a job and return its parsed JSON. Raises RuntimeError if it fails or is cancelled."""
+        while True:
+            status = self.scheduler.queue.status(job_id)
+            if status["status"] == STATUS_COMPLETED:
+                return json.loads(self.scheduler.queue.result(job_id)["cleaned_response"])
+            if status["status"] in (STATUS_FAILED, STATUS_CANCELLED):
+                raise RuntimeError(f"Job {job_id} {status['status']}: {status['error']}")
+            time.sleep(self.poll_interval)
+
+    def __call__(self, html: str) -> dict:
+        return self.result(self.submit(html))
+
+def make_queued_converter(scheduler: ConversionScheduler, json_template: str, model: str = "llama-3.3-70b", max_tokens: int = 8000,
+                          temperature: float = 0.6, top_p: float = 0.95, api_key: Optional[str] = None, poll_interval: float = 0.5) -> QueuedConverter:
+    """Build a fragment converter that runs each conversion as a batch job"""
+    return QueuedConverter(scheduler, json_template, model, max_tokens, temperature, top_p, api_key, poll_interval)
+
+def start_conversion(convert: Callable[[str], dict], html: str) -> Callable[[], dict]:
+    """Start converting `html` and return a callable that waits for the result
+
+    Converters with a submit()/result() pair (see QueuedConverter) start right away;
+    plain callables run when the result is asked for.
+    """
+    if hasattr(convert, "submit"):
+        job = convert.submit(html)
+        return lambda: convert.result(job)
+    return lambda: convert(html)
+
+def convert_site(pages: Dict[str, str], convert: Callable[[str], dict], mode: str = MODE_INLINE, min_pages: int = 2,
+                 on_page: Optional[Callable[[str, dict], None]] = None, template_ids: Optional[Dict[str, int]] = None) -> dict:
+    """Convert a set of pages, converting each shared fragment only once
+
+    Each page's own content is converted in one call with placeholders where the shared
+    fragments go, and the converted fragments are spliced in at the placeholders. All
+    conversions are started before any result is collected.
+
+    Returns {"pages": {name: bricks_json}, "templates": {...}, "stats": {...}}. In template
+    mode shared fragments are emitted once under "templates" and referenced from pages
+    with Bricks "template" elements; `template_ids` maps template names to the post IDs
+    they were imported as (see link_templates()). A failed conversion only fails the
+    pages that need it; they are listed with their error in stats["failed_pages"].
+    `on_page(name, bricks_json)` is called as soon as each page is finished.
+    """
+    shared = find_shared_fragments(pages, min_pages)
+    shared_pending = {fragment_id: start_conversion(convert, entry["html"]) for fragment_id, entry in shared.items()}
+    page_pending = {}
+    for page_name, html in pages.items():
+        markup, fragment_ids = page_markup(html, set(shared))
+        pending = start_conversion(convert, markup) if is_significant(PLACEHOLDER_PATTERN.sub("", markup)) else None
+        page_pending[page_name] = (pending, fragment_ids)
+
+    shared_elements = {}
+    shared_errors = {}
+    for fragment_id, pending in shared_pending.items():
+        try:
+            shared_elements[fragment_id] = extract_elements(pending())
+        except Exception as e:
+            shared_errors[fragment_id] = f"{type(e).__name__}: {str(e)}"
+    templates = {}
+    if mode == MODE_TEMPLATE:
+        templates = {
+            f"shared-{fragment_id}": {"pages": shared[fragment_id]["pages"], "elements": elements}
+            for fragment_id, elements in shared_elements.items()
+        }
+
+    converted_pages = {}
+    failed_pages = {}
+    for page_name, (pending, fragment_ids) in page_pending.items():
+        page_hash = hashlib.sha1(page_name.encode("utf-8")).hexdigest()[:6]
+        try:
+            replacements = []
+            for index, fragment_id in enumerate(fragment_ids):
+                if fragment_id in shared_errors:
+                    raise RuntimeError(f"Shared fragment {fragment_id} failed: {shared_errors[fragment_id]}")
+                if mode == MODE_TEMPLATE:
+                    replacements.append([{
+                        "id": f"tpl{fragment_id[:6]}-{page_hash}{index}",
+                        "name": "template",
+                        "settings": {"template": f"shared-{fragment_id}"}
+                    }])
+                else:
+                    replacements.append(namespace_ids(shared_elements[fragment_id], f"{page_hash}{index}"))
+            if pending is None:
+                # Nothing but shared fragments on this page
+                elements = [element for replacement in replacements for element in replacement]
+            else:
+                # The page's own IDs get the page's namespace so they can't collide with the spliced-in copies
+                elements = splice_placeholders(namespace_ids(extract_elements(pending()), page_hash), replacements)
+        except Exception as e:
+            failed_pages[page_name] = f"{type(e).__name__}: {str(e)}"
+            continue
+        converted_pages[page_name] = {"elements": elements}
+        if template_ids:
+            link_templates(converted_pages[page_name], template_ids)
+        if on_page:
+            on_page(page_name, converted_pages[page_name])
+
+    occurrences = sum(len(entry["pages"]) for entry in shared.values())
+    return {
+        "pages": converted_pages,
+        "templates": templates,
+        "stats": {
+            "pages": len(pages),
+            "shared_fragments": len(shared),
+            "shared_occurrences": occurrences,
+            "conversions": len(shared) + sum(1 for pending, _ in page_pending.values() if pending is not None),
+            "input_tokens_saved": sum(estimate_tokens(entry["html"]) * (len(entry["pages"]) - 1) for entry in shared.values()),
+            "failed_fragments": len(shared_errors),
+            "failed_pages": failed_pages
+        }
+    }
+
+def main(argv: Optional[List[str]] = None):
+    """Convert a set of HTML files from the command line"""
+    parser = argparse.ArgumentParser(description="Convert a whole site to Bricks Builder JSON, converting shared fragments once")
+    parser.add_argument("pages", nargs="+", help="HTML files of the site")
+    parser.add_argument("--template", default=os.path.join("examples", "sample_template.json"), help="Bricks JSON template file")
+    parser.add_argument("--output", default="_site_output", help="Directory for the converted JSON files")
+    parser.add_argument("--mode", choices=[MODE_INLINE, MODE_TEMPLATE], default=MODE_INLINE)
+    parser.add_argument("--template-ids", help="JSON file mapping template names from _templates.json to their imported post IDs")
+    parser.add_argument("--min-pages", type=int, default=2, help="Minimum number of pages a fragment must appear on to be shared")
+    parser.add_argument("--model", default="qwen-3-235b-a22b")
+    parser.add_argument("--max-tokens", type=int, default=8000)
+    parser.add_argument("--dry-run", action="store_true", help="Only report shared fragments, don't call the API")
+    args = parser.parse_args(argv)
+
+    pages = {}
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages[os.path.basename(path)] = f.read()
+
+    if args.dry_run:
+        shared = find_shared_fragments(pages, args.min_pages)
+        print(f"🔍 {len(shared)} shared fragments across {len(pages)} pages")
+        for fragment_id, entry in shared.items():
+            print(f"  {fragment_id}: {len(entry['pages'])} pages, ~{estimate_tokens(entry['html'])} tokens - {normalize_fragment(entry['html'])[:60]}")
+        return 0
+
+    api_key = os.environ.get("CEREBRAS_API_KEY", "")
+    if not api_key:
+        print("❌ Set the CEREBRAS_API_KEY environment variable")
+        return 1
+
+    from cerebras.cloud.sdk import Cerebras
+    with open(args.template, 'r', encoding='utf-8') as f:
+        json_template = f.read()
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    template_ids = None
+    if args.template_ids:
+        with open(args.template_ids, 'r', encoding='utf-8') as f:
+            template_ids = json.load(f)
+
+    def write_page(page_name: str, bricks_json: dict):
+        # Written as soon as each page is done, so an interrupted run keeps its finished pages
+        with open(os.path.join(args.output, os.path.splitext(page_name)[0] + ".json"), 'w', encoding='utf-8') as f:
+            json.dump(bricks_json, f, indent=2, ensure_ascii=False)
+
+    # Conversions run through the job queue so rate limits, retries and backoff apply
+    scheduler = ConversionScheduler(JobQueue(), client_factory=lambda key: Cerebras(api_key=key)).start()
+    try:
+        convert = make_queued_converter(scheduler, json_template, args.model, args.max_tokens, api_key=api_key)
+        result = convert_site(pages, convert, args.mode, args.min_pages, on_page=write_page, template_ids=template_ids)
+    finally:
+        scheduler.stop(timeout=5)
+
+    if result["templates"]:
+        with open(os.path.join(args.output, "_templates.json"), 'w', encoding='utf-8') as f:
+            json.dump(result["templates"], f, indent=2, ensure_ascii=False)
+
+    stats = result["stats"]
+    print(f"✅ Converted {len(result['pages'])} of {stats['pages']} pages with {stats['conversions']} conversions")
+    print(f"♻️ {stats['shared_fragments']} shared fragments reused {stats['shared_occurrences']} times, ~{stats['input_tokens_saved']} input tokens saved")
+    for page_name, error in stats["failed_pages"].items():
+        print(f"❌ {page_name}: {error}")
+    return 1 if stats["failed_pages"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
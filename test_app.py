@@ -48,6 +48,517 @@ def test_app_structure():
         print(f"❌ Error testing app structure: {e}")
         return False
 
+def test_job_queue():
+    """Test that queued jobs are persisted, prioritized, leased and cancellable"""
+    import tempfile
+    import time
+    from job_queue import JobQueue, PRIORITY_INTERACTIVE, STATUS_CANCELLED, STATUS_RUNNING
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "jobs.db")
+        queue = JobQueue(db_path, lease_seconds=0.5)
+        batch_id = queue.submit({"input_content": "<p>batch</p>", "json_template": "{}"})
+        interactive_id = queue.submit({"input_content": "<p>now</p>", "json_template": "{}"}, PRIORITY_INTERACTIVE)
+        cancelled_id = queue.submit({"input_content": "<p>never</p>", "json_template": "{}"})
+        queue.cancel(cancelled_id)
+        keyed_id = queue.submit({"input_content": "<p>keyed</p>", "json_template": "{}"}, PRIORITY_INTERACTIVE, "key-a")
+        
+        job = queue.claim_next()
+        if job["id"] != interactive_id:
+            print("❌ Interactive job was not claimed first")
+            return False
+        # Jobs are only claimed by owners that hold their API key
+        if queue.claim_next(["key-b"])["id"] != batch_id or queue.claim_next(["key-b"]) is not None:
+            print("❌ A job was claimed without its API key")
+            return False
+        if [job["id"] for job in queue.list_jobs(api_key_id="key-a")] != [keyed_id]:
+            print("❌ Jobs are not listed per API key")
+            return False
+        queue.release(batch_id)
+        queue.close()
+        
+        # A second owner on the same database must not take over a job that is still leased
+        other = JobQueue(db_path)
+        if other.status(interactive_id)["status"] != STATUS_RUNNING or other.claim_next()["id"] != batch_id:
+            print("❌ A leased job was taken over by another owner")
+            return False
+        if other.complete(interactive_id, {"raw_response": "", "cleaned_response": ""}):
+            print("❌ A job was finished by an owner that does not hold it")
+            return False
+        
+        # Once the lease runs out (the first owner is gone), the job is claimed again
+        time.sleep(0.6)
+        recovered = other.claim_next()
+        statuses = {job_id: other.status(job_id)["status"] for job_id in (batch_id, interactive_id, cancelled_id)}
+        keyed = other.claim_next(["key-a"])
+        other.close()
+        if recovered is None or recovered["id"] != interactive_id or recovered["attempts"] != 2:
+            print(f"❌ Orphaned job was not recovered: {recovered}")
+            return False
+        if statuses != {batch_id: STATUS_RUNNING, interactive_id: STATUS_RUNNING, cancelled_id: STATUS_CANCELLED}:
+            print(f"❌ Unexpected job statuses: {statuses}")
+            return False
+        if keyed is None or keyed["id"] != keyed_id or keyed["api_key_id"] != "key-a":
+            print(f"❌ Job was not claimed with its API key: {keyed}")
+            return False
+    
+    print("✅ Job queue persists, prioritizes, leases and cancels jobs")
+    return True
+
+def test_job_scheduler():
+    """Test rate limiting, throttling on 429 and retries with backoff"""
+    import tempfile
+    import threading
+    import time
+    from types import SimpleNamespace
+    from job_queue import (
+        AdaptiveConcurrency, ConversionScheduler, JobQueue, RateLimiter, TokenBucket,
+        STATUS_COMPLETED
+    )
+    
+    bucket = TokenBucket(60)
+    if bucket.reserve(60) != 0 or not 0.9 < bucket.reserve(1) <= 1.0:
+        print("❌ Token bucket does not make callers wait once empty")
+        return False
+    
+    limiter = RateLimiter({"test-model": {"requests_per_minute": 600, "tokens_per_minute": 600000}})
+    limiter.throttle("test-model", 0.2)
+    started = time.monotonic()
+    limiter.acquire("test-model", 10)
+    if time.monotonic() - started < 0.15:
+        print("❌ Throttled model was not paused")
+        return False
+    
+    # Interactive reservations go ahead of batch requests waiting on the same limits
+    limiter = RateLimiter({"test-model": {"requests_per_minute": 60, "tokens_per_minute": 600000}})
+    for _ in range(60):
+        if not limiter.acquire("test-model", 10, threading.Event()):
+            print("❌ Batch request was refused with capacity left")
+            return False
+    if not 0.9 < limiter.reserve("test-model", 10) <= 1.0:
+        print("❌ Interactive reservation did not wait only for its own cost")
+        return False
+    stop = threading.Event()
+    threading.Timer(1.5, stop.set).start()
+    if limiter.acquire("test-model", 10, stop):
+        print("❌ Batch request went ahead of an interactive reservation")
+        return False
+    
+    concurrency = AdaptiveConcurrency(4)
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+    if concurrency.limit != 1.0:
+        print(f"❌ Concurrency did not halve on throttling: {concurrency.limit}")
+        return False
+    
+    class RateLimitError(Exception):
+        status_code = 429
+        response = SimpleNamespace(status_code=429, headers={"retry-after": "0.1"})
+    
+    calls = []
+    
+    def convert(client, payload, cancel_token=None):
+        calls.append(client)
+        if len(calls) == 1:
+            raise RateLimitError("Too many requests")
+        return {"raw_response": "{}", "cleaned_response": "{}", "usage": {"total_tokens": 100}}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"))
+        scheduler = ConversionScheduler(
+            queue, client_factory=lambda api_key: f"client:{api_key}", max_workers=4,
+            rate_limits={"test-model": {"requests_per_minute": 600, "tokens_per_minute": 600000}},
+            convert=convert, poll_interval=0.02
+        ).start()
+        job_id = scheduler.submit({"input_content": "<p>Hi</p>", "json_template": "{}", "model": "test-model"}, api_key="secret")
+        deadline = time.monotonic() + 5
+        while queue.status(job_id)["status"] != STATUS_COMPLETED and time.monotonic() < deadline:
+            time.sleep(0.02)
+        scheduler.stop(timeout=2)
+        status = queue.status(job_id)
+        stored = queue._execute("SELECT payload FROM jobs WHERE id = ?", (job_id,))[0]["payload"]
+        queue.close()
+    
+    if status["status"] != STATUS_COMPLETED or status["attempts"] != 2 or calls != ["client:secret"] * 2:
+        print(f"❌ Rate-limited job was not retried to completion: {status}, {calls}")
+        return False
+    if "secret" in stored or scheduler.concurrency.limit >= 4 or "test-model" not in scheduler.limiter.blocked_until:
+        print("❌ API key was stored or 429 did not throttle the scheduler")
+        return False
+    
+    print("✅ Scheduler throttles on 429 and retries with backoff")
+    return True
+
+def test_output_viewer():
+    """Test that large outputs are paged and browsed lazily from one copy"""
+    import json
+    from output_viewer import OutputDocument, stream_tail
+    
+    elements = [{"id": f"el-{i}", "name": "div", "settings": {}, "elements": []} for i in range(120)]
+    raw = "<think>planning</think>\n```json\n" + json.dumps({"elements": elements}) + "\n```"
+    doc = OutputDocument(raw)
+    
+    if json.loads(doc.cleaned)["elements"][0]["id"] != "el-0":
+        print("❌ Cleaned output does not match")
+        return False
+    if not doc.shares_raw or doc.cleaned_size != len(doc.cleaned):
+        print("❌ Cleaned output is stored as a second copy")
+        return False
+    edited = OutputDocument(raw, json.dumps({"elements": []}))
+    if edited.shares_raw or edited.cleaned != '{"elements": []}':
+        print("❌ Cleaned output that is not part of the raw response was lost")
+        return False
+    if "".join(doc.raw_page(i, 100) for i in range(doc.page_count(100))) != raw:
+        print("❌ Raw pages do not cover the response")
+        return False
+    children = doc.children(("elements",), 0, 50)
+    if len(children) != 50 or children[0][0] != ("elements", 0) or doc.child_count(("elements",)) != 120:
+        print("❌ Tree children are not paged")
+        return False
+    if stream_tail(["ab", "cd", "ef"], 3) != "def":
+        print("❌ Stream tail is wrong")
+        return False
+    
+    print("✅ Output viewer pages and browses large outputs")
+    return True
+
+def test_reasoning_filter():
+    """Test that reasoning blocks and code fences are dropped while streaming"""
+    from conversion import ReasoningFilter, filter_reasoning, clean_output
+    
+    raw = "<think>Let me plan the <div> layout...</think>\n```json\n{\"elements\": [\"<p>\"]}\n```"
+    chunks = [raw[i:i + 3] for i in range(0, len(raw), 3)]
+    reasoning_filter = ReasoningFilter()
+    output = "".join(filter_reasoning(chunks, reasoning_filter))
+    
+    if output != clean_output(raw):
+        print(f"❌ Streaming filter output differs from clean_output: {output!r}")
+        return False
+    if reasoning_filter.reasoning_chars != len("Let me plan the <div> layout..."):
+        print("❌ Reasoning characters were not counted")
+        return False
+    
+    fenced = "```html\n<div>{}</div>\n```"
+    if "".join(filter_reasoning([fenced[:4], fenced[4:]], ReasoningFilter())) != clean_output(fenced):
+        print("❌ Non-JSON code fence is not handled like clean_output")
+        return False
+    for doubled in ("```json\n```x", "```json\n```"):
+        if "".join(filter_reasoning([doubled[:8], doubled[8:]], ReasoningFilter())) != clean_output(doubled):
+            print("❌ More than one leading code fence was removed")
+            return False
+    
+    capped = ReasoningFilter(max_reasoning_tokens=5)
+    if "".join(filter_reasoning(["<think>"] + ["thinking " * 10] * 10 + ["</think>{}"], capped)) or not capped.reasoning_limit_reached:
+        print("❌ Reasoning cap did not stop the stream")
+        return False
+    
+    print("✅ Reasoning filter strips thinking and fences on the fly")
+    return True
+
+def test_site_deduplication():
+    """Test that fragments shared across pages are converted once and nothing else is lost"""
+    import json
+    from site_converter import PLACEHOLDER_PATTERN, convert_site, link_templates, page_markup, split_fragments
+    
+    header = "<header><nav><a href='/'>Home</a></nav></header>"
+    pages = {
+        name: f"<html><body><div id='page' class='wrap'>{header}<main><h1>{name}</h1></main></div></body></html>"
+        for name in ("index.html", "about.html", "contact.html")
+    }
+    calls = []
+    
+    def convert(html):
+        # Like the model: the wrapper becomes one element and each placeholder is carried through as text
+        calls.append(html)
+        placeholders = [{"id": "unique-id", "name": "text-basic", "settings": {"text": match.group(0)}} for match in PLACEHOLDER_PATTERN.finditer(html)]
+        return {"elements": [{"id": "unique-id", "name": "div", "settings": {}, "elements": placeholders + [{"id": "el1", "name": "heading", "settings": {}}]}]}
+    
+    result = convert_site(pages, convert)
+    if len(calls) != 1 + len(pages) or sum(header in call for call in calls) != 1 or sum("class='wrap'" in call and "</div>" in call for call in calls) != len(pages):
+        print(f"❌ Expected the header once and each page in one call with its wrapper, got {calls}")
+        return False
+    page_elements = result["pages"]["index.html"]["elements"]
+    if len(page_elements) != 1 or [child["name"] for child in page_elements[0]["elements"]] != ["div", "heading"]:
+        print(f"❌ Shared fragment was not spliced in at its placeholder: {page_elements}")
+        return False
+    
+    def all_ids(elements):
+        return [id for element in elements for id in [element["id"]] + all_ids(element.get("elements") or [])]
+    ids = [all_ids(page["elements"]) for page in result["pages"].values()]
+    if any(len(set(page_ids)) != len(page_ids) for page_ids in ids) or len({id for page_ids in ids for id in page_ids}) != sum(map(len, ids)):
+        print(f"❌ Element IDs are not namespaced: {ids}")
+        return False
+    
+    template_result = convert_site(pages, convert, mode="template")
+    template_ids = {name: 42 for name in template_result["templates"]}
+    template_element = link_templates(template_result["pages"]["about.html"], template_ids)["elements"][0]["elements"][0]
+    if template_element["name"] != "template" or template_element["settings"]["template"] != 42:
+        print(f"❌ Template reference was not linked to its post ID: {template_element}")
+        return False
+    
+    # Conversions are all submitted before any result is collected
+    events = []
+    
+    class BatchConverter:
+        def submit(self, html):
+            events.append("submit")
+            return html
+        
+        def result(self, html):
+            events.append("result")
+            return convert(html)
+    
+    convert_site(pages, BatchConverter())
+    if events != ["submit"] * 4 + ["result"] * 4:
+        print(f"❌ Conversions were not all submitted before collecting: {events}")
+        return False
+    
+    # Wrappers with text of their own and loose text between fragments are kept
+    page = "<body><div class='hero' style='color: red'>Intro <b>bold</b> more</div>Loose text<p>End</p></body>"
+    markup, fragment_ids = page_markup(page, set())
+    if [page[start:end] for start, end in split_fragments(page)][0] != "<div class='hero' style='color: red'>Intro <b>bold</b> more</div>" or "Loose text" not in markup or fragment_ids:
+        print(f"❌ Page content was dropped while splitting: {markup!r}")
+        return False
+    
+    def flaky_convert(html):
+        if "about.html" in html:
+            raise json.JSONDecodeError("Expecting value", "", 0)
+        return convert(html)
+    
+    written = []
+    result = convert_site(pages, flaky_convert, on_page=lambda name, bricks_json: written.append(name))
+    if list(result["stats"]["failed_pages"]) != ["about.html"] or written != ["index.html", "contact.html"]:
+        print(f"❌ A failed page was not isolated: {result['stats']['failed_pages']}")
+        return False
+    
+    print("✅ Shared fragments are converted once and reused")
+    return True
+
+def test_benchmark_generators():
+    """Test that the synthetic benchmark inputs have the requested size"""
+    import json
+    from benchmark import generate_html, generate_bricks_tree, generate_response, compare
+    
+    size = 50 * 1024
+    html = generate_html(size)
+    tree = generate_bricks_tree(size)
+    if not size <= len(html) < size * 1.1 or not size <= len(json.dumps(tree)) < size * 1.1:
+        print("❌ Synthetic inputs are not close to the requested size")
+        return False
+    response = generate_response(size)
+    if not response.startswith("<think>"):
+        print("❌ Synthetic response has no reasoning block")
+        return False
+    if not size <= len(response) < size * 1.1 or not size <= len(json.dumps(generate_bricks_tree(size, indent=2), indent=2)) < size * 1.1:
+        print(f"❌ Synthetic response is not close to the requested size: {len(response)}")
+        return False
+    
+    baseline = {"results": {"json_load/1MB": {"seconds": 0.010, "peak_bytes": 1000000}}}
+    current = {"results": {"json_load/1MB": {"seconds": 0.020, "peak_bytes": 1000000}}}
+    if len(compare(current, baseline)) != 1 or compare(baseline, baseline):
+        print("❌ Baseline comparison is wrong")
+        return False
+    
+    print("✅ Benchmark generators and baseline comparison work")
+    return True
+
+def test_streamed_ingestion():
+    """Test that large files are preprocessed in chunks and indexed by section"""
+    import tempfile
+    from ingest import ingest_chunks
+    
+    html = (
+        "<html><head><script>var tag = '<div>';</script></head><body><div id='page'>"
+        "<header class='site'>Logo</header><!-- nav --><main>" + "<p>Content</p>" * 500 + "</main>"
+        "<footer>Footer</footer></div></body></html>"
+    ).encode("utf-8")
+    chunks = [html[i:i + 100] for i in range(0, len(html), 100)]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        doc = ingest_chunks(chunks, "page.html", tmp)
+        if [section["tag"] for section in doc.sections] != ["header", "main", "footer"]:
+            print(f"❌ Unexpected section index: {doc.sections}")
+            return False
+        if "<script>" in doc.read() or "<!--" in doc.read():
+            print("❌ Scripts or comments were not removed")
+            return False
+        if doc.read(0) != "<header class='site'>Logo</header>" or len(doc.preview(50)) != 50:
+            print("❌ Sections or preview are not read back correctly")
+            return False
+        
+        # Omitted end tags are not invented and <pre> keeps its whitespace
+        source = "<body><p>Intro<section>A</section><ul><li>1<li>2</ul><pre>a\n   b</pre></body>"
+        doc = ingest_chunks([source.encode("utf-8")], "implied.html", tmp)
+        if doc.read() != source or [(section["tag"], section["level"]) for section in doc.sections] != [("p", 1), ("section", 1), ("ul", 1), ("pre", 1)]:
+            print(f"❌ Implied end tags changed the structure: {doc.read()!r}")
+            return False
+        
+        # Whitespace collapses the same wherever the chunks are cut, and <head> is never a section
+        source = b"<head><title>T</title></head><div>a   \n   b</div>"
+        doc = ingest_chunks([source[i:i + 7] for i in range(0, len(source), 7)], "chunked.html", tmp)
+        text = ingest_chunks([b"a   \n", b"   b"], "split.html", tmp).read()
+        if "<div>a b</div>" not in doc.read() or text != "a b" or [section["tag"] for section in doc.sections] != ["div"]:
+            print(f"❌ Chunking changed the output or <head> was indexed: {doc.read()!r}, {doc.sections}")
+            return False
+    
+    print("✅ Large files are ingested in chunks with a section index")
+    return True
+
+def test_global_classes():
+    """Test that repeated styles are hoisted into global classes"""
+    from global_classes import hoist_global_classes
+    
+    button_style = {"_padding": "12px 24px", "_borderRadius": "6px", "_background": {"color": {"hex": "#ff6b6b"}}}
+    tree = {"elements": [
+        {"id": f"btn{i}", "name": "button", "settings": dict(button_style, text=f"Button {i}")}
+        for i in range(10)
+    ] + [{"id": "hero", "name": "heading", "settings": {"text": "Hi", "_fontSize": "3rem"}}]}
+    
+    hoisted, report = hoist_global_classes(tree)
+    classes = hoisted.get("globalClasses", [])
+    if len(classes) != 1 or classes[0]["settings"] != button_style:
+        print(f"❌ Expected one global class for the buttons, got {classes}")
+        return False
+    button = hoisted["elements"][0]["settings"]
+    if button != {"text": "Button 0", "_cssGlobalClasses": [classes[0]["id"]]}:
+        print(f"❌ Button settings were not replaced by a class reference: {button}")
+        return False
+    if hoisted["elements"][-1]["settings"] != tree["elements"][-1]["settings"] or report["bytes_after"] >= report["bytes_before"]:
+        print("❌ Unique styles changed or payload did not shrink")
+        return False
+    # Interactions and conditions are per-element behaviour and stay on the element
+    behaviour = {"_interactions": [{"id": "i1", "trigger": "click", "action": "show"}], "_conditions": [[{"key": "user_logged_in"}]]}
+    tree = {"elements": [{"id": f"cta{i}", "name": "button", "settings": dict(button_style, **behaviour)} for i in range(5)]}
+    hoisted, _ = hoist_global_classes(tree)
+    if any(key not in element["settings"] for element in hoisted["elements"] for key in behaviour) or any(
+            key in global_class["settings"] for global_class in hoisted.get("globalClasses", []) for key in behaviour):
+        print("❌ Interactions or conditions were hoisted into a global class")
+        return False
+    try:
+        hoist_global_classes("abc")
+        print("❌ A scalar JSON root was not rejected")
+        return False
+    except ValueError:
+        pass
+    
+    print("✅ Repeated styles are hoisted into global classes")
+    return True
+
+def test_conversion_cancellation():
+    """Test that cancelling a conversion closes the stream and keeps the partial output"""
+    import threading
+    import time
+    from types import SimpleNamespace
+    import tempfile
+    from conversion import CancellationToken, ConversionCancelled, clean_output, run_conversion
+    from job_queue import ConversionScheduler, JobQueue, STATUS_CANCELLED, STATUS_COMPLETED, STATUS_RUNNING
+    
+    class FakeStream:
+        def __init__(self):
+            self.closed = threading.Event()
+        
+        def __iter__(self):
+            for i in range(1000):
+                if self.closed.wait(0.01):
+                    raise ConnectionError("stream closed")
+                yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=f"{{{i}}}<"))])
+        
+        def close(self):
+            self.closed.set()
+    
+    stream = FakeStream()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: stream)))
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+    
+    started = time.monotonic()
+    try:
+        run_conversion(client, "<p>Hi</p>", "{}", max_tokens=8000, cancel_token=token)
+        print("❌ Conversion was not cancelled")
+        return False
+    except ConversionCancelled as e:
+        partial = e.partial
+    
+    if not stream.closed.is_set() or time.monotonic() - started > 2:
+        print("❌ Stream was not closed promptly")
+        return False
+    if not partial["raw_response"] or not partial["metrics"]["cancelled"] or partial["metrics"]["tokens_saved"] <= 0:
+        print(f"❌ Partial output or tokens saved missing: {partial['metrics']}")
+        return False
+    if partial["cleaned_response"] != clean_output(partial["raw_response"]):
+        print("❌ Held-back output is missing from the partial result")
+        return False
+    
+    # A job cancelled while it waits on the rate limiter frees its slot and reservation at once
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"))
+        scheduler = ConversionScheduler(
+            queue, client_factory=lambda api_key: None, max_workers=1,
+            rate_limits={"slow-model": {"requests_per_minute": 1, "tokens_per_minute": 100000}},
+            convert=lambda client, payload, cancel_token=None: {"raw_response": "{}", "cleaned_response": "{}", "usage": {}},
+            poll_interval=0.02
+        ).start()
+        payload = {"input_content": "<p>Hi</p>", "json_template": "{}", "model": "slow-model", "max_tokens": 100}
+        first_id = scheduler.submit(payload)
+        waiting_id = scheduler.submit(payload)
+        deadline = time.monotonic() + 5
+        while (queue.status(first_id)["status"] != STATUS_COMPLETED or queue.status(waiting_id)["status"] != STATUS_RUNNING) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        time.sleep(0.1)
+        scheduler.cancel(waiting_id)
+        # The only worker must be free again well before the 60 second wait would have ended
+        other_id = scheduler.submit(dict(payload, model="other-model"))
+        while queue.status(other_id)["status"] != STATUS_COMPLETED and time.monotonic() < deadline:
+            time.sleep(0.02)
+        requests_bucket, _ = scheduler.limiter.buckets["slow-model"]
+        requests_bucket.adjust(0)
+        scheduler.stop(timeout=2)
+        statuses = (queue.status(waiting_id)["status"], queue.status(other_id)["status"])
+        queue.close()
+    if statuses != (STATUS_CANCELLED, STATUS_COMPLETED) or requests_bucket.tokens < -0.5:
+        print(f"❌ Job waiting on the rate limiter was not released on cancel: {statuses}, {requests_bucket.tokens}")
+        return False
+    
+    # A running job cancelled from another process is stopped by its scheduler, and the
+    # completion tokens it did not generate are given back
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"))
+        streams = []
+        
+        def client_factory(api_key):
+            streams.append(FakeStream())
+            return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: streams[-1])))
+        
+        scheduler = ConversionScheduler(
+            queue, client_factory=client_factory, max_workers=1,
+            rate_limits={"test-model": {"requests_per_minute": 600, "tokens_per_minute": 9000}}, poll_interval=0.02
+        ).start()
+        job_id = scheduler.submit({"input_content": "<p>Hi</p>", "json_template": "{}", "model": "test-model", "max_tokens": 8000})
+        deadline = time.monotonic() + 5
+        while not streams and time.monotonic() < deadline:
+            time.sleep(0.02)
+        time.sleep(0.1)
+        other = JobQueue(queue.db_path)
+        other.cancel(job_id)
+        other.close()
+        while not (streams and streams[0].closed.is_set()) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        time.sleep(0.1)
+        _, tokens_bucket = scheduler.limiter.buckets["test-model"]
+        tokens_left = tokens_bucket.tokens
+        scheduler.stop(timeout=2)
+        partial = queue.result(job_id)
+        queue.close()
+    if not streams[0].closed.is_set() or not partial or not partial["metrics"]["cancelled"]:
+        print("❌ Job cancelled by another process kept running")
+        return False
+    if tokens_left < 6000:
+        print(f"❌ Tokens of a cancelled job were not given back: {tokens_left}")
+        return False
+    
+    print("✅ Cancelled conversions close the stream and keep partial output")
+    return True
+
 def test_environment():
     """Test environment setup"""
     print(f"Python version: {sys.version}")
@@ -77,7 +588,16 @@ def main():
     tests = [
         ("Environment", test_environment),
         ("Imports", test_imports),
-        ("App Structure", test_app_structure)
+        ("App Structure", test_app_structure),
+        ("Job Queue", test_job_queue),
+        ("Job Scheduler", test_job_scheduler),
+        ("Output Viewer", test_output_viewer),
+        ("Reasoning Filter", test_reasoning_filter),
+        ("Site Deduplication", test_site_deduplication),
+        ("Benchmark Generators", test_benchmark_generators),
+        ("Streamed Ingestion", test_streamed_ingestion),
+        ("Global Classes", test_global_classes),
+        ("Conversion Cancellation", test_conversion_cancellation)
     ]
     
     all_passed = True